@@ -0,0 +1,103 @@
+'''
+Local copy of the strava activities, so every run only has to ask strava for the walks since the last sync.
+
+Activities are kept in a small sqlite file keyed by the strava activity id.
+The newest stored start_date is used as the after=<epoch> cursor for the next sync, and the
+aggregation reads straight from here instead of the api.
+'''
+
+import calendar
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from aggregation import STRAVA_DATE_FORMAT, to_date
+
+
+def strava_epoch(start_date: str) -> int:
+    #start_date from strava is utc, eg. 2024-01-01T06:30:00Z
+    return calendar.timegm(datetime.strptime(start_date, STRAVA_DATE_FORMAT).timetuple())
+
+
+class ActivityStore:
+    def __init__(self, path: str = "strava_activities.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS activities (
+                id INTEGER PRIMARY KEY,
+                start_date TEXT NOT NULL,
+                start_date_local TEXT NOT NULL,
+                distance REAL,
+                elapsed_time INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS activities_start_date_local ON activities (start_date_local);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _state(self, key: str):
+        row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def sync_cursor(self, last_hydro_date) -> int:
+        '''
+        Epoch to send as strava's after= parameter.
+        Normally this is the newest activity we already have. If the store has never been synced back as far
+        as the last hydro date (first run, or an older hydro date), start from the day before that date instead,
+        the extra day covers the difference between local and utc time.
+        '''
+        cutoff = to_date(last_hydro_date) - timedelta(days=1)
+        cutoff_epoch = calendar.timegm(cutoff.timetuple())
+        synced_from = self._state("synced_from")
+        if synced_from is None or cutoff_epoch < synced_from:
+            return cutoff_epoch
+        newest = self.conn.execute("SELECT MAX(start_date) FROM activities").fetchone()[0]
+        return strava_epoch(newest) if newest else synced_from
+
+    def mark_synced(self, after: int):
+        #remember how far back the store is complete, so later runs can use the newest activity as the cursor
+        synced_from = self._state("synced_from")
+        if synced_from is None or after < synced_from:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('synced_from', ?)", (after,))
+
+    def upsert(self, activities: list) -> int:
+        rows = [(a["id"], a["start_date"], a["start_date_local"], a.get("distance"), a["elapsed_time"]) for a in activities]
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO activities (id, start_date, start_date_local, distance, elapsed_time)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    start_date = excluded.start_date,
+                    start_date_local = excluded.start_date_local,
+                    distance = excluded.distance,
+                    elapsed_time = excluded.elapsed_time
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def activities_since(self, last_hydro_date) -> pd.DataFrame:
+        #newest first, same order as the strava api
+        since = to_date(last_hydro_date).strftime('%Y-%m-%d')
+        return pd.read_sql_query(
+            "SELECT start_date_local, distance, elapsed_time FROM activities WHERE start_date_local >= ? ORDER BY start_date_local DESC",
+            self.conn,
+            params=(since,),
+        )
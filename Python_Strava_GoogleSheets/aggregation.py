@@ -0,0 +1,88 @@
+'''
+Turns the Strava activities into the daily walk table that goes into the google sheet.
+
+Every activity is dropped into a date x {morning, afternoon, evening, night} matrix in one pass:
+the day offset from the last hydro date, the time slot from the start time and the floored minutes
+are all worked out as arrays, so there is no per-activity strptime or .loc writes anymore.
+'''
+
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+SLOTS = ["morning", "afternoon", "evening", "night"]
+FEATURE_LIST = ["date"] + SLOTS + ["total"]
+
+# If 0000-1100 - morning. 1101-1600 - afternoon, 1601-2100 - evening, 2101-2359 - night
+# a walk that starts exactly on a boundary stays in the earlier slot, seconds are ignored like before
+SLOT_EDGES = np.array([11 * 3600, 16 * 3600, 21 * 3600])
+
+STRAVA_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+SHEET_DATE_FORMAT = '%d/%m/%Y'
+
+
+def to_date(value) -> date:
+    #the last hydro date comes from the sheet as dd/mm/yyyy, but allow date/datetime objects too
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, SHEET_DATE_FORMAT).date()
+
+
+def aggregate_activities(activities: pd.DataFrame, last_hydro_date) -> pd.DataFrame:
+    '''
+    Sum the walk minutes per day and time slot, starting from the last hydro date.
+    activities needs the start_date_local (strava format) and elapsed_time (seconds) columns.
+    Returns one row per day from the last hydro date up to the latest activity, with integer minutes.
+    '''
+    cutoff = np.datetime64(to_date(last_hydro_date), 'D')
+
+    starts = pd.to_datetime(activities['start_date_local'], format=STRAVA_DATE_FORMAT).to_numpy(dtype='datetime64[s]')
+    days = starts.astype('datetime64[D]')
+    offsets = (days - cutoff).astype(np.int64)
+
+    #seconds of the day, floored to the minute
+    second_of_day = (starts - days).astype(np.int64)
+    second_of_day -= second_of_day % 60
+    slots = np.searchsorted(SLOT_EDGES, second_of_day, side='left')
+
+    minutes = np.asarray(activities['elapsed_time'], dtype=np.int64) // 60
+
+    #anything before the last hydro date is not part of this block
+    keep = offsets >= 0
+    offsets, slots, minutes = offsets[keep], slots[keep], minutes[keep]
+
+    number_of_rows = int(offsets.max()) + 1 if len(offsets) else 0
+    matrix = np.bincount(offsets * len(SLOTS) + slots, weights=minutes, minlength=number_of_rows * len(SLOTS))
+    matrix = matrix.astype(np.int64).reshape(number_of_rows, len(SLOTS))
+
+    formatted_df = pd.DataFrame(matrix, columns=SLOTS)
+    formatted_df.insert(0, 'date', pd.Series(cutoff + np.arange(number_of_rows)).dt.strftime(SHEET_DATE_FORMAT))
+    formatted_df['total'] = matrix.sum(axis=1)
+    return formatted_df
+
+
+def format_minutes(minutes, zero=None) -> np.ndarray:
+    '''
+    Vectorised version of the h/m formatting: 75 -> "1h 15m", 45 -> "45m".
+    If zero is given, days with 0 minutes get that value instead of "0m".
+    '''
+    minutes = np.asarray(minutes, dtype=np.int64)
+    hours, remainder = np.divmod(minutes, 60)
+    hours_minutes = hours.astype(str).astype(object) + "h " + remainder.astype(str).astype(object) + "m"
+    only_minutes = minutes.astype(str).astype(object) + "m"
+    output = np.where(minutes >= 60, hours_minutes, only_minutes)
+    if zero is not None:
+        output[minutes == 0] = zero
+    return output
+
+
+def format_durations(aggregated: pd.DataFrame) -> pd.DataFrame:
+    #empty slots are left as 0 in the sheet, the total always shows the minutes
+    formatted_df = aggregated.copy()
+    for col in SLOTS:
+        formatted_df[col] = format_minutes(aggregated[col], zero=0)
+    formatted_df['total'] = format_minutes(aggregated['total'])
+    return formatted_df
@@ -0,0 +1,99 @@
+'''
+Runs several strava -> google sheet jobs in parallel, eg. one per dog/walker.
+
+Every job gets its own process, at most `workers` at a time. A job that fails or goes past the timeout
+is stopped and reported without affecting the others, and a summary with the wall time of each job is printed at the end.
+
+Config file for python main.py --batch jobs.json:
+{
+    "jobs": [
+        {"name": "bobo", "strava_tokens": "bobo_strava_tokens.json", "spreadsheet_id": "...", "range": "Sheet1!A2:G"},
+        {"name": "mochi", "strava_tokens": "mochi_strava_tokens.json", "spreadsheet_id": "...", "range": "Walks!A2:G",
+         "google_token": "mochi_token.json"}
+    ]
+}
+'''
+
+import json
+import multiprocessing
+import time
+import traceback
+
+
+def load_config(path: str) -> list:
+    with open(path) as config_file:
+        config = json.load(config_file)
+    jobs = config["jobs"] if isinstance(config, dict) else config
+    names = [job.get("name", "default") for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("every job in the batch config needs a different name")
+    return jobs
+
+
+def _worker(target, job, kwargs, conn):
+    #runs in the child process, the result or the error goes back through the pipe
+    try:
+        conn.send(("ok", target(job, **kwargs)))
+    except BaseException as err:
+        conn.send(("failed", f"{type(err).__name__}: {err}\n{traceback.format_exc()}"))
+    finally:
+        conn.close()
+
+
+def run_batch(jobs: list, target, workers: int = 4, timeout: float = 300, **kwargs) -> list:
+    '''
+    Call target(job, **kwargs) for every job in a pool of worker processes.
+    Returns one {"name", "status", "result"/"error", "wall_time"} per job, in the order of the jobs.
+    status is ok, failed or timeout.
+    '''
+    ctx = multiprocessing.get_context("spawn")
+    pending = list(jobs)
+    running = {}
+    summary = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop(0)
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_worker, args=(target, job, kwargs, sender), name=f"job-{job.name}")
+            process.start()
+            sender.close()
+            running[job.name] = (process, receiver, time.monotonic())
+
+        for name, (process, receiver, started) in list(running.items()):
+            wall_time = time.monotonic() - started
+            # check is_alive before poll, a process that has exited has already sent everything it will send
+            alive = process.is_alive()
+            if receiver.poll():
+                try:
+                    status, detail = receiver.recv()
+                except EOFError:
+                    # the process died before it could report anything
+                    status, detail = "failed", f"worker exited with code {process.exitcode}"
+                process.join()
+            elif not alive:
+                status, detail = "failed", f"worker exited with code {process.exitcode}"
+            elif wall_time > timeout:
+                process.terminate()
+                process.join()
+                status, detail = "timeout", f"stopped after {timeout:.0f}s"
+            else:
+                continue
+            receiver.close()
+            del running[name]
+            summary[name] = {"name": name, "status": status, "wall_time": wall_time,
+                             "result" if status == "ok" else "error": detail}
+        time.sleep(0.05)
+
+    return [summary[job.name] for job in jobs]
+
+
+def print_summary(summary: list, batch_time: float = None):
+    print(f"{'job':<20} {'status':<8} {'wall time (s)':>13}  details")
+    for job in summary:
+        details = job.get("result", "")
+        if job["status"] != "ok":
+            details = job["error"].splitlines()[0]
+        print(f"{job['name']:<20} {job['status']:<8} {job['wall_time']:>13.2f}  {details}")
+    if batch_time is not None:
+        print(f"batch wall time: {batch_time:.2f}s")
@@ -0,0 +1,108 @@
+'''
+Micro-benchmark for the aggregation step.
+Generates synthetic strava activities and compares the old iterrows loop against the batched aggregation.
+
+Usage: python benchmark.py --sizes 10000 100000 1000000 --legacy-limit 10000
+'''
+
+import argparse
+import math
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from aggregation import SLOTS, aggregate_activities, format_durations
+from stub_server import synthetic_activity_records
+
+
+def synthetic_activities(n: int, last_hydro_date: str = "01/01/2024", days: int = 120, seed: int = 0) -> pd.DataFrame:
+    #the stub server's random walks after the last hydro date, as a frame and newest first like the strava api
+    records = synthetic_activity_records(n, datetime.strptime(last_hydro_date, '%d/%m/%Y'), days=days, seed=seed)
+    return pd.DataFrame.from_records(records[::-1], columns=["start_date_local", "distance", "elapsed_time"])
+
+
+def legacy_aggregate(df: pd.DataFrame, last_hydro_date: str) -> pd.DataFrame:
+    #the original loop from main.py, kept here only to compare against
+    number_of_rows = datetime.strptime(df['start_date_local'].iloc[0], '%Y-%m-%dT%H:%M:%SZ').toordinal() - datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()+1
+    feature_list = ["date", "morning", "afternoon", "evening", "night", "total"]
+    formatted_df = pd.DataFrame(0, index=np.arange(number_of_rows), columns=feature_list).astype(object)
+
+    for index, row in df.iterrows():
+        start_date_local = row['start_date_local'].replace("T","*").replace("Z","*")
+        re = start_date_local.split("*")
+        timestart = re[1]
+        datestart = re[0]
+
+        hr_min = timestart.split(":")
+        time_start_in_seconds = int(hr_min[0]) * 3600 + int(hr_min[1]) * 60
+
+        day = datetime.strptime(datestart, '%Y-%m-%d').toordinal() - datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()
+        formatted_df.loc[day,'date'] = datetime.strptime(datestart, '%Y-%m-%d').strftime("%d/%m/%Y")
+        if time_start_in_seconds > 21*3600:
+            col = 'night'
+        elif time_start_in_seconds > 16*3600:
+            col = 'evening'
+        elif time_start_in_seconds > 11*3600:
+            col = 'afternoon'
+        else:
+            col = 'morning'
+        formatted_df.loc[day,col] = formatted_df[col].iloc[day] + math.floor(int(row['elapsed_time'])/60)
+
+    row_num = 0
+    for index, row in formatted_df.iterrows():
+        total_time_for_day = int(row['morning']) + int(row['afternoon']) + int(row['evening']) + int(row['night'])
+        if total_time_for_day >= 60:
+            formatted_df.loc[row_num,'total'] = str(math.floor(total_time_for_day/60)) + "h " + str(total_time_for_day - math.floor(total_time_for_day/60)*60) + "m"
+        else:
+            formatted_df.loc[row_num,'total'] = str(total_time_for_day) + "m"
+        for col in SLOTS:
+            if int(row[col]) >= 60:
+                formatted_df.loc[row_num,col] = str(math.floor(int(row[col])/60)) + "h " + str(int(row[col]) - math.floor(int(row[col])/60)*60) + "m"
+            elif int(row[col]) == 0:
+                formatted_df.loc[row_num,col] = 0
+            else:
+                formatted_df.loc[row_num,col] = str(row[col]) + "m"
+        row_num = row_num+1
+    return formatted_df
+
+
+def batched_aggregate(df: pd.DataFrame, last_hydro_date: str) -> pd.DataFrame:
+    return format_durations(aggregate_activities(df, last_hydro_date))
+
+
+def timed(fn, *args, repeat: int = 1) -> tuple:
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=10_000, help="skip the old loop above this many activities, it is very slow")
+    parser.add_argument("--days", type=int, default=120, help="length of the gap between hydro sessions")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    last_hydro_date = "01/01/2024"
+    print(f"{'activities':>12} {'batched (s)':>12} {'legacy (s)':>12} {'speedup':>9}")
+    for n in args.sizes:
+        df = synthetic_activities(n, last_hydro_date, days=args.days)
+        batched_time, batched = timed(batched_aggregate, df, last_hydro_date, repeat=args.repeat)
+        if n <= args.legacy_limit:
+            legacy_time, legacy = timed(legacy_aggregate, df, last_hydro_date)
+            cols = SLOTS + ["total"]
+            if not batched[cols].astype(str).equals(legacy[cols].astype(str)):
+                raise SystemExit(f"batched and legacy results differ for {n} activities")
+            print(f"{n:>12} {batched_time:>12.4f} {legacy_time:>12.4f} {legacy_time / batched_time:>8.1f}x")
+        else:
+            print(f"{n:>12} {batched_time:>12.4f} {'-':>12} {'-':>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+'''
+End to end benchmark of the strava -> google sheets flow, without strava or google.
+
+The stand-ins from stub_server.py run in their own process with synthetic activities and a synthetic sheet,
+and run_job from main.py is pointed at them. Two scenarios are measured:
+- cold: empty local store and sheet index, like the very first run
+- warm: the same job again straight after, like a rerun on the same day
+For each one the wall time, number of http requests, body bytes sent + received and peak python memory (tracemalloc,
+client side only) are reported.
+
+Usage:
+python benchmark_pipeline.py --activities 20000 --days 365 --latency 0.02 --save-baseline baseline.json
+python benchmark_pipeline.py --activities 20000 --days 365 --latency 0.02 --baseline baseline.json
+the second command exits with 1 if any number went up by more than the allowed tolerance.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from main import SyncJob, run_job
+from stub_server import StubState, start_stub_server, synthetic_activity_records, synthetic_sheet
+
+# how much worse than the baseline a number may get before it counts as a regression
+TOLERANCES = {"wall_time": 0.5, "requests": 0.0, "bytes": 0.1, "peak_memory": 0.25}
+
+
+def _serve(config: dict, conn):
+    state = StubState(synthetic_activity_records(config["activities"], days=config["days"]),
+                      synthetic_sheet(days=config["days"], hydro_every=config["hydro_every"]),
+                      latency=config["latency"], fail_every=config["fail_every"])
+    server = start_stub_server(state)
+    conn.send(server.server_address[1])
+    conn.close()
+    while True:
+        time.sleep(60)
+
+
+def start_stand_ins(config: dict):
+    ctx = multiprocessing.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_serve, args=(config, sender), daemon=True)
+    process.start()
+    port = receiver.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+
+def make_job(workdir: str, url: str) -> SyncJob:
+    #fake google token that never expires, and a strava token that has expired so the refresh is exercised too
+    google_token = os.path.join(workdir, "token.json")
+    with open(google_token, "w") as token:
+        json.dump({"token": "stub", "refresh_token": "stub", "client_id": "stub", "client_secret": "stub",
+                   "expiry": "2999-01-01T00:00:00Z"}, token)
+    strava_tokens = os.path.join(workdir, "strava_tokens.json")
+    with open(strava_tokens, "w") as token:
+        json.dump({"access_token": "expired", "refresh_token": "stub", "expires_at": 0}, token)
+    return SyncJob(name="bench", strava_tokens=strava_tokens, spreadsheet_id="bench", range="Sheet1!A2:G",
+                   google_token=google_token, store=os.path.join(workdir, "strava_activities.db"),
+                   sheet_index=os.path.join(workdir, "sheet_index.json"), strava_url=url, sheets_url=url)
+
+
+def measure(job: SyncJob, url: str) -> dict:
+    before = requests.get(url + "/__stats").json()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_job(job)
+    wall_time = time.perf_counter() - started
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    after = requests.get(url + "/__stats").json()
+    return {
+        "wall_time": round(wall_time, 4),
+        "requests": after["requests"] - before["requests"],
+        "bytes": (after["bytes_sent"] - before["bytes_sent"]) + (after["bytes_received"] - before["bytes_received"]),
+        "peak_memory": peak_memory,
+        "days": result["days"],
+        "changed_ranges": result["changed_ranges"],
+    }
+
+
+def compare(results: dict, baseline: dict) -> list:
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, tolerance in TOLERANCES.items():
+            expected = baseline.get(scenario, {}).get(metric)
+            if expected is not None and metrics[metric] > expected * (1 + tolerance):
+                regressions.append(f"{scenario} {metric}: {metrics[metric]} vs baseline {expected} (+{tolerance:.0%} allowed)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--activities", type=int, default=5000, help="synthetic activities in the strava stand-in")
+    parser.add_argument("--days", type=int, default=365, help="days of history, in strava and in the sheet")
+    parser.add_argument("--hydro-every", type=int, default=21, help="days between hydro sessions in the sheet")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every stand-in response")
+    parser.add_argument("--fail-every", type=int, default=0, help="make every nth strava request fail with 429")
+    parser.add_argument("--baseline", help="json file to compare against, exit 1 on a regression")
+    parser.add_argument("--save-baseline", help="write the results to this json file")
+    args = parser.parse_args()
+
+    config = {"activities": args.activities, "days": args.days, "hydro_every": args.hydro_every,
+              "latency": args.latency, "fail_every": args.fail_every}
+    process, url = start_stand_ins(config)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            job = make_job(workdir, url)
+            results = {"cold": measure(job, url), "warm": measure(job, url)}
+    finally:
+        process.terminate()
+
+    print(f"{'scenario':<8} {'wall time (s)':>13} {'requests':>9} {'bytes':>10} {'peak memory':>12} {'days':>5} {'ranges':>7}")
+    for scenario, m in results.items():
+        print(f"{scenario:<8} {m['wall_time']:>13.3f} {m['requests']:>9} {m['bytes']:>10} {m['peak_memory']:>12} {m['days']:>5} {m['changed_ranges']:>7}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({"config": config, **results}, baseline_file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file))
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,203 +8,253 @@ Have a dataframe that Nrows (number of dates) Ncols (5), populate all with 0s
 Loop through each strava activity. If 0000-1100 - morning. 1101-1600 - afternoon, 1601-2100 - evening, 2101-2359 - night
 Strava API returns the elapsed time in seconds, change it to minutes. if >60, change to h and m
 Insert the dataframe into the google sheets starting from the last "Hydro" row
+
+Usage: python main.py [--dry-run] [--snapshot]
+To sync several dogs/walkers (each with their own strava tokens and sheet) in parallel: python main.py --batch jobs.json, see batch.py
 '''
 
-# Retrieve activities
-import pandas as pd
-import requests
+import argparse
 import json
-from datetime import datetime
-import numpy as np
-import math
+import os.path
+import tempfile
 import time
+from dataclasses import dataclass
 
-import os.path
+import requests
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from activity_store import ActivityStore
+from aggregation import SLOTS, aggregate_activities, format_durations
+from batch import load_config, print_summary, run_batch
+from sheets import SheetsClient
+from strava_fetcher import STRAVA_BASE_URL, StravaFetcher
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SAMPLE_SPREADSHEET_ID = "" #remove for privacy
 SAMPLE_RANGE_NAME = "Sheet1!A2:G"
 
-creds = None
-if os.path.exists("token.json"):
-	creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-  	# If there are no (valid) credentials available, let the user log in.
-	if not creds or not creds.valid:
-		flow = InstalledAppFlow.from_client_secrets_file(
-          	"credentials.json", SCOPES
-      	)
-		creds = flow.run_local_server(port=0)
-    		# Save the credentials for the next run
-		with open("token.json", "w") as token:
-			token.write(creds.to_json())
-try:
-    service = build("sheets", "v4", credentials=creds)
-    # Sheets API
-    sheet = service.spreadsheets()
-    result = (
-        sheet.values()
-        .get(spreadsheetId=SAMPLE_SPREADSHEET_ID, range=SAMPLE_RANGE_NAME)
-        .execute()
-    )
-    values = result.get("values", [])
-    
-    if not values:
-        print("No data found")
-    
-    # print(values)
-    
-    bool_break = False
-    for row in reversed(values):
-        if bool_break == False:
-            for element in row:
-                if "hydro" in element.lower():
-                    last_hydro_date = row[0]
-                    print(last_hydro_date)
-                    bool_break = True
-        else:
-            break
-except HttpError as err:
-    print(err)
-
-## Get the tokens from file to connect to Strava
-with open('strava_tokens.json') as json_file:
-    strava_tokens = json.load(json_file)
-## If access_token has expired then use the refresh_token to get the new access_token
-if strava_tokens['expires_at'] < time.time():
-#Make Strava auth API call with current refresh token
-    response = requests.post(
-                        url = 'https://www.strava.com/oauth/token',
-                        data = {
-                                'client_id': '', #removed for privacy
-                                'client_secret': '', #removed for privacy
-                                'grant_type': 'refresh_token',
-                                'refresh_token': strava_tokens['refresh_token']
-                                }
-                    )
-#Save response as json in new variable
-    new_strava_tokens = response.json()
-# Save new tokens to file
-    with open('strava_tokens.json', 'w') as outfile:
-        json.dump(new_strava_tokens, outfile)
-#Use new Strava tokens from now
-    strava_tokens = new_strava_tokens
-    
-# Loop through all activities
-page = 1
-url = "https://www.strava.com/api/v3/activities"
-access_token = strava_tokens['access_token']
-# Create the dataframe ready for the API call to store your activity data
-activities = pd.DataFrame(
-    columns = [
-            "start_date_local",
-            "distance",
-            "elapsed_time",
-    ]
-)
-while True:
-    # get page of activities from Strava
-    r = requests.get(url + '?access_token=' + access_token + '&per_page=200' + '&page=' + str(page))
-    r = r.json()
-    
-    # if no results then exit loop
-    if (not r):
-        break
-    
-    # otherwise add new data to dataframe
-    for x in range(len(r)):
-        #need to read the google sheets and return the date of the last hydro
-        if datetime.strptime(r[x]['start_date_local'], '%Y-%m-%dT%H:%M:%SZ').toordinal() >= datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal():
-            activities.loc[x + (page-1)*200,'start_date_local'] = r[x]['start_date_local']
-            activities.loc[x + (page-1)*200,'distance'] = r[x]['distance']
-            activities.loc[x + (page-1)*200,'elapsed_time'] = r[x]['elapsed_time']
-        else:
-            break
-    # increment page
-    page += 1
-activities.to_csv('strava_activities.csv')
-
-##read in the activity csv
-df = pd.read_csv('strava_activities.csv')
-df = df.reset_index()  # make sure indexes pair with number of rows
-
-#get the number of rows for formatted df
-number_of_rows = datetime.strptime(df['start_date_local'].iloc[0], '%Y-%m-%dT%H:%M:%SZ').toordinal() - datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()+1
-#cols of df are start_date_local	distance	elapsed_time
-feature_list = ["date", "morning", "afternoon", "evening", "night", "total"]
-formatted_df = pd.DataFrame(0, index=np.arange(number_of_rows), columns=feature_list) 
-
-for index, row in df.iterrows():
-    #extract the time from between T and Z
-    row['start_date_local']=row['start_date_local'].replace("T","*")
-    row['start_date_local']=row['start_date_local'].replace("Z","*")
-    re=row['start_date_local'].split("*")
-    timestart=re[1]
-    datestart = re[0]
-    
-    #extract the hour, minute
-    hr_min = timestart.split(":")
-    hr = int(hr_min[0]) * 3600 #convert to seconds
-    sec = int(hr_min[1]) * 60
-    time_start_in_seconds = hr + sec
-    
-    #fill in the date
-    formatted_df.loc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal(),'date'] = datetime.strptime(datestart, '%Y-%m-%d').strftime("%d/%m/%Y")
-
-    #If 0000-1100 - morning. 1101-1630 - afternoon, 1631-2100 - evening, 2101-2359 - night
-    if time_start_in_seconds > 21*3600:
-        formatted_df.loc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal(),'night'] = formatted_df['night'].iloc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()] + math.floor(int(row['elapsed_time'])/60)
-    elif time_start_in_seconds > 16*3600:
-        formatted_df.loc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal(),'evening'] = formatted_df['evening'].iloc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()] + math.floor(int(row['elapsed_time'])/60)
-    elif time_start_in_seconds > 11*3600:
-        formatted_df.loc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal(),'afternoon'] = formatted_df['afternoon'].iloc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()] + math.floor(int(row['elapsed_time'])/60)
-    else: 
-        formatted_df.loc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal(),'morning'] = formatted_df['morning'].iloc[datetime.strptime(datestart, '%Y-%m-%d').toordinal()- datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal()] + math.floor(int(row['elapsed_time'])/60)
-
-#loop through the formatted_df 
-
-row_num = 0
-for index, row in formatted_df.iterrows():
-    total_time_for_day = int(row['morning']) + int(row['afternoon']) + int(row['evening']) + int(row['night'])
-    
-    if total_time_for_day >= 60:
-        formatted_df.loc[row_num,'total'] = str(math.floor(total_time_for_day/60)) + "h " + str(total_time_for_day - math.floor(total_time_for_day/60)*60) + "m"
-    else:
-        formatted_df.loc[row_num,'total'] = str(total_time_for_day) + "m"
-    
-    list_of_cols = ['morning', 'afternoon', 'evening', 'night']
-    for col in list_of_cols:
-        if int(row[col]) >= 60:
-            formatted_df.loc[row_num,col] = str(math.floor(int(row[col])/60)) + "h " + str(int(row[col]) - math.floor(int(row[col])/60)*60) + "m"
-        elif int(row[col]) == 0:
-            formatted_df.loc[row_num,col] = 0
-        else:
-            formatted_df.loc[row_num,col] = str(row[col]) + "m"
-    
-    row_num = row_num+1
-formatted_df.to_csv('format_strava_activities.csv', index=False)
-
-# Read the CSV file, find which gsheet row to start writing, send API
-df = pd.read_csv('format_strava_activities.csv')
-df = df.drop('date', axis=1)
-
-values = [df.columns.values.tolist()]
-values = df.values.tolist()
-service = build("sheets", "v4", credentials=creds)
-body = {"values": values}
-result = (
-        service.spreadsheets()
-        .values()
-        .update(
-            spreadsheetId=SAMPLE_SPREADSHEET_ID,
-            range="Sheet1!C" + str(datetime.strptime(last_hydro_date, '%d/%m/%Y').toordinal() - datetime.strptime("27/10/2023", '%d/%m/%Y').toordinal() +3),
-            valueInputOption='RAW',
-            body=body,
+
+@dataclass
+class SyncJob:
+    '''
+    One strava account + google sheet pair.
+    range is the block of the sheet that is tracked, eg. Sheet1!A2:G: the date is in the first column, the hydro
+    note in the second, and morning, afternoon, evening, night, total in the next five.
+    '''
+    name: str = "default"
+    strava_tokens: str = "strava_tokens.json"
+    spreadsheet_id: str = SAMPLE_SPREADSHEET_ID
+    range: str = SAMPLE_RANGE_NAME
+    google_token: str = "token.json"
+    store: str = "strava_activities.db"
+    sheet_index: str = "sheet_index.json"
+    # only changed to point the job at local stand-ins, see benchmark_pipeline.py
+    strava_url: str = STRAVA_BASE_URL
+    sheets_url: str = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SyncJob":
+        #the local files default to <name>_..., so jobs in one batch don't share a store or an index
+        name = config.get("name", "default")
+        defaults = {"store": f"{name}_activities.db", "sheet_index": f"{name}_sheet_index.json"}
+        return cls(**{**defaults, **config})
+
+    @property
+    def sheet_name(self) -> str:
+        return self.range.split("!")[0]
+
+    @property
+    def first_col(self) -> str:
+        return self.range.split("!")[1][0]
+
+    @property
+    def first_row(self) -> int:
+        start = self.range.split("!")[1].split(":")[0]
+        return int(start[1:] or 1)
+
+
+def column_after(col: str, n: int) -> str:
+    return chr(ord(col) + n)
+
+
+def write_atomically(path: str, text: str):
+    #write to a temp file next to it and swap it in, so a process reading the file never sees it half written
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_google_credentials(token_file: str = "token.json"):
+    creds = None
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+    if creds and creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+    # If there are no (valid) credentials available, let the user log in.
+    elif not creds or not creds.valid:
+        flow = InstalledAppFlow.from_client_secrets_file(
+            "credentials.json", SCOPES
         )
-        .execute()
-    )
+        creds = flow.run_local_server(port=0)
+    else:
+        # still valid, nothing new to save. batch jobs share this file, so it is only written when it changed
+        return creds
+    # Save the credentials for the next run
+    write_atomically(token_file, creds.to_json())
+    return creds
+
+
+def open_sheet(job: SyncJob) -> SheetsClient:
+    client_options = {"api_endpoint": job.sheets_url} if job.sheets_url else None
+    service = build("sheets", "v4", credentials=load_google_credentials(job.google_token), client_options=client_options)
+    return SheetsClient(service, job.spreadsheet_id, job.sheet_name, job.first_row,
+                        marker_columns=(job.first_col, column_after(job.first_col, 1)), index_path=job.sheet_index)
+
+
+def find_last_hydro(sheet: SheetsClient):
+    #read the marker columns of the google sheets and return the date and row of the last hydro
+    last_hydro_date, last_hydro_row = sheet.last_hydro()
+    if last_hydro_date is None:
+        print("No data found")
+    return last_hydro_date, last_hydro_row
+
+
+def load_strava_tokens(token_file: str = "strava_tokens.json", strava_url: str = STRAVA_BASE_URL):
+    ## Get the tokens from file to connect to Strava
+    with open(token_file) as json_file:
+        strava_tokens = json.load(json_file)
+    ## If access_token has expired then use the refresh_token to get the new access_token
+    if strava_tokens['expires_at'] < time.time():
+        #Make Strava auth API call with current refresh token
+        response = requests.post(
+                            url = strava_url + '/oauth/token',
+                            data = {
+                                    'client_id': '', #removed for privacy
+                                    'client_secret': '', #removed for privacy
+                                    'grant_type': 'refresh_token',
+                                    'refresh_token': strava_tokens['refresh_token']
+                                    }
+                        )
+        #Save response as json in new variable
+        new_strava_tokens = response.json()
+        # Save new tokens to file
+        write_atomically(token_file, json.dumps(new_strava_tokens))
+        #Use new Strava tokens from now
+        strava_tokens = new_strava_tokens
+    return strava_tokens
+
+
+# The pipeline is fetch -> filter -> aggregate -> format -> write, everything stays in memory.
+# Each stage takes the output of the one before it, csv snapshots are only written with --snapshot
+
+def fetch_activities(store: ActivityStore, access_token: str, last_hydro_date, strava_url: str = STRAVA_BASE_URL) -> int:
+    # Only ask strava for the activities since the last sync, the rest are already in the local store
+    after = store.sync_cursor(last_hydro_date)
+    fetcher = StravaFetcher(access_token, base_url=strava_url)
+    fetched = 0
+    # with after= the pages come back oldest first, the fetcher stops at the first page that is not full
+    for page in fetcher.pages(after=after):
+        fetched += store.upsert(page)
+    store.mark_synced(after)
+    return fetched
+
+
+def filter_activities(store: ActivityStore, last_hydro_date):
+    # the activities started on or after the last hydro date, built into one dataframe by the store
+    return store.activities_since(last_hydro_date)
+
+
+def aggregate(activities, last_hydro_date):
+    #sum the minutes per day and time slot
+    return aggregate_activities(activities, last_hydro_date)
+
+
+def format_table(aggregated):
+    #change the minutes to h and m, and turn the table into the rows that go into the sheet
+    formatted_df = format_durations(aggregated)
+    return formatted_df, formatted_df[SLOTS + ['total']].to_numpy(dtype=object).tolist()
+
+
+def write_back(sheet: SheetsClient, start_row: int, values, dry_run: bool = False, first_col: str = "C"):
+    # the block starts on the row of the last hydro date, C to G are morning, afternoon, evening, night, total
+    # only the cells that are different from what is already in the sheet are sent, so reruns are cheap and safe
+    if not values:
+        print("No walks to write")
+        return []
+    last_col = column_after(first_col, len(values[0]) - 1)
+    current = sheet.read_block(start_row, len(values), first_col=first_col, last_col=last_col)
+    changes = sheet.diff(start_row, current, values, first_col=first_col)
+    if dry_run:
+        for a1, old, new in changes:
+            print(f"{a1}: {old} -> {new}")
+        print(f"{len(changes)} range(s) would be updated")
+        return changes
+    result = sheet.write_changes(changes)
+    print(f"Updated {result.get('totalUpdatedCells', 0)} cell(s) in {len(changes)} range(s)")
+    return changes
+
+
+def run_job(job: SyncJob, dry_run: bool = False, snapshot: bool = False) -> dict:
+    sheet = open_sheet(job)
+    last_hydro_date, last_hydro_row = find_last_hydro(sheet)
+    if last_hydro_date is None:
+        raise ValueError(f"No Hydro session found in {job.range}")
+    print(f"[{job.name}] last hydro {last_hydro_date}")
+
+    strava_tokens = load_strava_tokens(job.strava_tokens, job.strava_url)
+    with ActivityStore(job.store) as store:
+        fetched = fetch_activities(store, strava_tokens['access_token'], last_hydro_date, job.strava_url)
+        activities = filter_activities(store, last_hydro_date)
+
+    aggregated = aggregate(activities, last_hydro_date)
+    formatted_df, values = format_table(aggregated)
+
+    if snapshot:
+        activities.to_csv(f'{job.name}_strava_activities.csv', index=False)
+        formatted_df.to_csv(f'{job.name}_format_strava_activities.csv', index=False)
+
+    # the block goes on the row of its first date, straight from the sheet index (no walks yet means no block)
+    start_row = sheet.row_for_date(formatted_df['date'].iloc[0]) if len(formatted_df) else None
+    start_row = start_row or last_hydro_row
+    changes = write_back(sheet, start_row, values, dry_run=dry_run, first_col=column_after(job.first_col, 2))
+    return {"last_hydro_date": last_hydro_date, "fetched": fetched, "days": len(values), "changed_ranges": len(changes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the walks since the last hydro session from Strava into the Google Sheet")
+    parser.add_argument("--snapshot", action="store_true", help="also save the activities and the formatted table as csv, for debugging")
+    parser.add_argument("--dry-run", action="store_true", help="print the cells that would change instead of writing them")
+    parser.add_argument("--batch", metavar="CONFIG", help="json file with a list of jobs to run in parallel, see batch.py")
+    parser.add_argument("--workers", type=int, default=4, help="number of jobs to run at the same time with --batch")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a --batch job is stopped")
+    args = parser.parse_args()
+
+    if args.batch:
+        jobs = [SyncJob.from_config(config) for config in load_config(args.batch)]
+        started = time.monotonic()
+        summary = run_batch(jobs, run_job, workers=args.workers, timeout=args.timeout,
+                            dry_run=args.dry_run, snapshot=args.snapshot)
+        print_summary(summary, time.monotonic() - started)
+        if any(result["status"] != "ok" for result in summary):
+            raise SystemExit(1)
+        return
+
+    try:
+        run_job(SyncJob(), dry_run=args.dry_run, snapshot=args.snapshot)
+    except HttpError as err:
+        print(err)
+
+
+if __name__ == "__main__":
+    main()
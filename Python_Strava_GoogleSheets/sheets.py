@@ -0,0 +1,157 @@
+'''
+Access layer for the walk tracking google sheet.
+
+Instead of downloading the whole A2:G range and scanning every cell for "Hydro", a small index is kept on disk:
+the row of every date in column A and the row of the last "Hydro" marker. A run only reads the marker columns
+from the last known hydro row down to the end of the sheet (a new hydro session can only be added after the last one),
+and writes go straight to the indexed row, only for the cells that are different from what is already there.
+'''
+
+import json
+import os.path
+
+INDEX_FILE = "sheet_index.json"
+
+
+class SheetsClient:
+    def __init__(self, service, spreadsheet_id: str, sheet: str = "Sheet1", first_row: int = 2,
+                 marker_columns: tuple = ("A", "B"), index_path: str = INDEX_FILE):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet = sheet
+        self.first_row = first_row
+        self.marker_columns = marker_columns
+        self.index_path = index_path
+        self.index = self._load_index()
+
+    def _empty_index(self) -> dict:
+        return {"spreadsheet_id": self.spreadsheet_id, "sheet": self.sheet, "row_count": 0,
+                "dates": {}, "last_hydro_row": None, "last_hydro_date": None}
+
+    def _load_index(self) -> dict:
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+            if index.get("spreadsheet_id") == self.spreadsheet_id and index.get("sheet") == self.sheet:
+                return index
+        return self._empty_index()
+
+    def _save_index(self):
+        with open(self.index_path, "w") as index_file:
+            json.dump(self.index, index_file)
+
+    def row_count(self) -> int:
+        #only the grid size of our sheet, not the whole spreadsheet resource
+        result = (
+            self.service.spreadsheets()
+            .get(spreadsheetId=self.spreadsheet_id, ranges=[self.sheet],
+                 fields="sheets(properties(title,gridProperties(rowCount)))")
+            .execute()
+        )
+        for sheet in result.get("sheets", []):
+            if sheet["properties"]["title"] == self.sheet:
+                return sheet["properties"]["gridProperties"]["rowCount"]
+        return 0
+
+    def refresh_index(self):
+        row_count = self.row_count()
+        if row_count < self.index["row_count"]:
+            # rows were deleted, the stored row numbers can't be trusted anymore
+            self.index = self._empty_index()
+
+        cached_row = self.index["last_hydro_row"]
+        if not self._scan(cached_row or self.first_row, row_count) and cached_row is not None:
+            # the cached hydro marker was cleared and there is none after it, so the last one is somewhere above.
+            # forget the index and look through the whole sheet again
+            self.index = self._empty_index()
+            self._scan(self.first_row, row_count)
+        self.index["row_count"] = row_count
+        self._save_index()
+
+    def _scan(self, start: int, row_count: int) -> bool:
+        #indexes the marker columns from start to the end of the sheet, true if there is a hydro marker in them
+        first_col, last_col = self.marker_columns
+        result = (
+            self.service.spreadsheets()
+            .values()
+            .get(spreadsheetId=self.spreadsheet_id,
+                 range=f"{self.sheet}!{first_col}{start}:{last_col}{max(row_count, start)}",
+                 valueRenderOption="FORMATTED_VALUE", fields="values")
+            .execute()
+        )
+        found = False
+        for row_number, row in enumerate(result.get("values", []), start=start):
+            if not row:
+                continue
+            if row[0]:
+                self.index["dates"][row[0]] = row_number
+            if any("hydro" in str(element).lower() for element in row):
+                self.index["last_hydro_row"] = row_number
+                self.index["last_hydro_date"] = row[0]
+                found = True
+        return found
+
+    def last_hydro(self):
+        #date (dd/mm/yyyy) and row number of the last hydro session
+        self.refresh_index()
+        return self.index["last_hydro_date"], self.index["last_hydro_row"]
+
+    def row_for_date(self, date: str):
+        #row of a dd/mm/yyyy date in column A, None if it is not in the index
+        return self.index["dates"].get(date)
+
+    def read_block(self, start_row: int, number_of_rows: int, first_col: str = "C", last_col: str = "G") -> list:
+        #what is in the sheet right now, as the raw values that were written. empty cells come back as ""
+        width = column_index(last_col) - column_index(first_col) + 1
+        result = (
+            self.service.spreadsheets()
+            .values()
+            .get(spreadsheetId=self.spreadsheet_id,
+                 range=f"{self.sheet}!{first_col}{start_row}:{last_col}{start_row + number_of_rows - 1}",
+                 valueRenderOption="UNFORMATTED_VALUE", fields="values")
+            .execute()
+        )
+        rows = result.get("values", [])
+        rows += [[]] * (number_of_rows - len(rows))
+        return [row + [""] * (width - len(row)) for row in rows]
+
+    def diff(self, start_row: int, current: list, values: list, first_col: str = "C") -> list:
+        '''
+        Compare the rows in the sheet with the newly computed ones.
+        Returns one change per row that is different, covering the first to the last changed cell of that row:
+        (a1 range, old cells, new cells)
+        '''
+        first = column_index(first_col)
+        changes = []
+        for row_number, (old_row, new_row) in enumerate(zip(current, values), start=start_row):
+            changed = [i for i, (old, new) in enumerate(zip(old_row, new_row)) if str(old) != str(new)]
+            if not changed:
+                continue
+            left, right = changed[0], changed[-1]
+            a1 = f"{self.sheet}!{column_letter(first + left)}{row_number}:{column_letter(first + right)}{row_number}"
+            changes.append((a1, old_row[left:right + 1], new_row[left:right + 1]))
+        return changes
+
+    def write_changes(self, changes: list):
+        #all the changed ranges go out in a single batchUpdate
+        if not changes:
+            return {"totalUpdatedCells": 0}
+        body = {
+            "valueInputOption": "RAW",
+            "data": [{"range": a1, "values": [new]} for a1, old, new in changes],
+        }
+        return (
+            self.service.spreadsheets()
+            .values()
+            .batchUpdate(spreadsheetId=self.spreadsheet_id, body=body, fields="totalUpdatedCells")
+            .execute()
+        )
+
+
+def column_index(letter: str) -> int:
+    #A -> 0, B -> 1 ... only single letters are needed for this sheet
+    return ord(letter.upper()) - ord("A")
+
+
+def column_letter(index: int) -> str:
+    return chr(ord("A") + index)
@@ -0,0 +1,154 @@
+'''
+Fetches pages of activities from the strava api.
+
+- one keep-alive requests.Session with timeouts, instead of a bare requests.get per page
+- a small thread pool that asks for the next pages while the current one is being read. The window starts at
+  1 page and only widens while pages keep coming back full, so a normal incremental sync is still one request
+- a token bucket driven by strava's X-RateLimit-Limit / X-RateLimit-Usage headers (15 minute and daily limits)
+- 429 and 5xx responses are retried with backoff instead of being indexed like a list of activities
+'''
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+STRAVA_BASE_URL = "https://www.strava.com"
+PER_PAGE = 200
+SHORT_WINDOW = 15 * 60  # strava's short rate limit window, in seconds
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class RateLimiter:
+    '''
+    Token bucket for the strava requests.
+    The bucket holds what is left of the 15 minute allowance and refills at limit/15min. Every response
+    re-syncs it from the rate limit headers, so requests made by other scripts with the same app are counted too.
+    '''
+
+    def __init__(self, short_limit: int = 200, daily_limit: int = 2000):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.tokens = float(short_limit)
+        self.daily_remaining = daily_limit
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.short_limit, self.tokens + (now - self.updated) * self.short_limit / SHORT_WINDOW)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.daily_remaining <= 0:
+                    raise RateLimitExceeded("Strava daily rate limit used up, try again tomorrow")
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.daily_remaining -= 1
+                    return
+                wait = (1 - self.tokens) * SHORT_WINDOW / self.short_limit
+            time.sleep(wait)
+
+    def update(self, headers):
+        #headers look like X-RateLimit-Limit: 200,2000 and X-RateLimit-Usage: 12,340
+        limit = headers.get("X-RateLimit-Limit")
+        usage = headers.get("X-RateLimit-Usage")
+        if not limit or not usage:
+            return
+        try:
+            short_limit, daily_limit = (int(x) for x in limit.split(","))
+            short_usage, daily_usage = (int(x) for x in usage.split(","))
+        except ValueError:
+            return
+        with self.lock:
+            self._refill()
+            self.short_limit = short_limit
+            self.daily_limit = daily_limit
+            self.tokens = min(self.tokens, max(short_limit - short_usage, 0))
+            self.daily_remaining = daily_limit - daily_usage
+
+
+def make_session(pool_size: int = 4) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class StravaFetcher:
+    def __init__(self, access_token: str, base_url: str = STRAVA_BASE_URL, session: requests.Session = None,
+                 rate_limiter: RateLimiter = None, prefetch: int = 4, timeout: float = 30, max_retries: int = 5,
+                 backoff: float = 1.0):
+        self.access_token = access_token
+        self.url = base_url.rstrip("/") + "/api/v3/activities"
+        self.prefetch = prefetch
+        self.session = session or make_session(pool_size=prefetch)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def get_page(self, page: int, per_page: int = PER_PAGE, **params) -> list:
+        params = {"per_page": per_page, "page": page, **params}
+        headers = {"Authorization": "Bearer " + self.access_token}
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                r = self.session.get(self.url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            self.rate_limiter.update(r.headers)
+            if r.status_code == 429:
+                if attempt == self.max_retries:
+                    r.raise_for_status()
+                retry_after = r.headers.get("Retry-After")
+                time.sleep(float(retry_after) if retry_after else self._backoff(attempt))
+                continue
+            if r.status_code >= 500 and attempt < self.max_retries:
+                time.sleep(self._backoff(attempt))
+                continue
+            r.raise_for_status()
+            return r.json()
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def pages(self, per_page: int = PER_PAGE, stop=None, **params):
+        '''
+        Yield the pages in order until an empty or short page.
+        stop(page) can end the paging early, eg. when a page already falls past the cutoff date.
+        '''
+        with ThreadPoolExecutor(max_workers=self.prefetch) as pool:
+            in_flight = {}
+            next_page = 1
+            window = 1
+            page_number = 1
+            try:
+                while True:
+                    while len(in_flight) < window:
+                        in_flight[next_page] = pool.submit(self.get_page, next_page, per_page, **params)
+                        next_page += 1
+                    page = in_flight.pop(page_number).result()
+                    page_number += 1
+                    if page:
+                        yield page
+                    if len(page) < per_page or (stop is not None and stop(page)):
+                        return
+                    # full page, there is probably more so ask further ahead
+                    window = min(window * 2, self.prefetch)
+            finally:
+                for future in in_flight.values():
+                    future.cancel()
@@ -0,0 +1,256 @@
+'''
+Local stand-ins for the apis this script talks to, so the whole flow can run without strava or google.
+
+- GET  /api/v3/activities                   pages of synthetic activities (newest first, or oldest first when after= is given like the real api),
+                                            with the X-RateLimit-* headers, and optionally some requests failing with 429 or 5xx
+- POST /oauth/token                         strava token refresh
+- GET  /v4/spreadsheets/<id>                sheet properties (row count)
+- GET  /v4/spreadsheets/<id>/values/<range> values.get
+- PUT  /v4/spreadsheets/<id>/values/<range> values.update
+- POST /v4/spreadsheets/<id>/values:batchUpdate
+- GET  /__stats                             number of requests and bytes sent/received so far, not counted itself
+
+Usage: python stub_server.py --activities 5000 --days 120 --latency 0.05 --port 8000
+then point a job at it with strava_url / sheets_url = "http://127.0.0.1:8000"
+'''
+
+import argparse
+import calendar
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from aggregation import SHEET_DATE_FORMAT, STRAVA_DATE_FORMAT
+
+
+def synthetic_activity_records(n: int, start: datetime = datetime(2024, 1, 1), days: int = 120, seed: int = 0) -> list:
+    #oldest first, ids go up with the start date like strava's do
+    rng = random.Random(seed)
+    offsets = sorted(rng.randrange(days * 86400) for _ in range(n))
+    records = []
+    for i, offset in enumerate(offsets):
+        start_local = start + timedelta(seconds=offset)
+        records.append({
+            "id": 1_000_000 + i,
+            "name": "Walk",
+            "start_date": (start_local - timedelta(hours=8)).strftime(STRAVA_DATE_FORMAT),
+            "start_date_local": start_local.strftime(STRAVA_DATE_FORMAT),
+            "distance": round(rng.uniform(200, 8000), 1),
+            "elapsed_time": rng.randrange(60, 3 * 3600),
+        })
+    return records
+
+
+def synthetic_sheet(start: datetime = datetime(2024, 1, 1), days: int = 120, hydro_every: int = 21) -> list:
+    #one row per day from row 2, with "Hydro" in column B every few weeks. row 1 is the header
+    rows = [["Date", "Notes", "Morning", "Afternoon", "Evening", "Night", "Total"]]
+    for day in range(days):
+        rows.append([(start + timedelta(days=day)).strftime(SHEET_DATE_FORMAT), "Hydro" if day % hydro_every == 0 else ""])
+    return rows
+
+
+def column_number(letters: str) -> int:
+    number = 0
+    for letter in letters.upper():
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number - 1
+
+
+def parse_a1(a1: str):
+    #Sheet1!C10:G12 -> (Sheet1, first row, first col, last row, last col), rows/cols from 0, missing ends are None
+    sheet, _, cells = a1.partition("!")
+    start, _, end = cells.partition(":")
+    (c1, r1), (c2, r2) = (re.match(r"([A-Z]*)(\d*)", part).groups() for part in (start, end or start))
+    return (sheet, int(r1) - 1 if r1 else 0, column_number(c1) if c1 else 0,
+            int(r2) - 1 if r2 else None, column_number(c2) if c2 else None)
+
+
+class StubState:
+    def __init__(self, activities: list, sheet_rows: list = None, sheet_name: str = "Sheet1", latency: float = 0.0,
+                 short_limit: int = 200, daily_limit: int = 2000, fail_every: int = 0, fail_status: int = 429,
+                 row_count: int = 1000):
+        self.activities = activities
+        self.epochs = [calendar.timegm(datetime.strptime(a["start_date"], STRAVA_DATE_FORMAT).timetuple()) for a in activities]
+        self.sheet_name = sheet_name
+        self.grid = [list(row) for row in (sheet_rows or [])]
+        self.row_count = max(row_count, len(self.grid))
+        self.latency = latency
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.strava_requests = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.lock = threading.RLock()
+
+    def page(self, page: int, per_page: int, after=None, before=None) -> list:
+        if after is None:
+            # no cursor, newest first
+            selected = [a for a, e in zip(reversed(self.activities), reversed(self.epochs)) if before is None or e < before]
+        else:
+            selected = [a for a, e in zip(self.activities, self.epochs) if e > after and (before is None or e < before)]
+        return selected[(page - 1) * per_page:page * per_page]
+
+    def read_range(self, a1: str) -> list:
+        _, r1, c1, r2, c2 = parse_a1(a1)
+        rows = []
+        for row in self.grid[r1:(r2 + 1 if r2 is not None else None)]:
+            cells = row[c1:(c2 + 1 if c2 is not None else None)]
+            while cells and cells[-1] in ("", None):
+                cells = cells[:-1]
+            rows.append(cells)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def write_range(self, a1: str, values: list) -> int:
+        _, r1, c1, _, _ = parse_a1(a1)
+        updated = 0
+        for i, row in enumerate(values):
+            while len(self.grid) <= r1 + i:
+                self.grid.append([])
+            target = self.grid[r1 + i]
+            target.extend([""] * (c1 + len(row) - len(target)))
+            target[c1:c1 + len(row)] = row
+            updated += len(row)
+        self.row_count = max(self.row_count, len(self.grid))
+        return updated
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "strava_requests": self.strava_requests,
+                "bytes_sent": self.bytes_sent, "bytes_received": self.bytes_received}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so session reuse shows up
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload, headers: dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path != "/__stats":
+            with self.server.state.lock:
+                self.server.state.bytes_sent += len(body)
+
+    def read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.state.lock:
+            self.server.state.bytes_received += len(body)
+        return body
+
+    def handle_request(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        if url.path == "/__stats":
+            self.send_json(200, state.stats())
+            return
+        with state.lock:
+            state.requests += 1
+        body = self.read_body()
+        if state.latency:
+            time.sleep(state.latency)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == "/api/v3/activities" and self.command == "GET":
+            self.activities(query)
+        elif url.path == "/oauth/token" and self.command == "POST":
+            self.send_json(200, {"token_type": "Bearer", "access_token": "stub-access-token",
+                                 "refresh_token": "stub-refresh-token", "expires_at": int(time.time()) + 6 * 3600,
+                                 "expires_in": 6 * 3600})
+        elif url.path.startswith("/v4/spreadsheets/"):
+            self.sheets(unquote(url.path[len("/v4/spreadsheets/"):]), query, body)
+        else:
+            self.send_json(404, {"message": "Record Not Found"})
+
+    do_GET = do_POST = do_PUT = handle_request
+
+    def activities(self, query: dict):
+        state = self.server.state
+        with state.lock:
+            state.strava_requests += 1
+            count = state.strava_requests
+        rate_headers = {
+            "X-RateLimit-Limit": f"{state.short_limit},{state.daily_limit}",
+            "X-RateLimit-Usage": f"{min(count, state.short_limit)},{min(count, state.daily_limit)}",
+        }
+        if state.fail_every and count % state.fail_every == 0:
+            self.send_json(state.fail_status, {"message": "Rate Limit Exceeded" if state.fail_status == 429 else "Server Error"},
+                           {**rate_headers, "Retry-After": "0"})
+            return
+        page = state.page(
+            int(query.get("page", 1)),
+            int(query.get("per_page", 30)),
+            int(query["after"]) if "after" in query else None,
+            int(query["before"]) if "before" in query else None,
+        )
+        self.send_json(200, page, rate_headers)
+
+    def sheets(self, path: str, query: dict, body: bytes):
+        state = self.server.state
+        spreadsheet_id, _, rest = path.partition("/")
+        with state.lock:
+            if not rest and self.command == "GET":
+                self.send_json(200, {"sheets": [{"properties": {"title": state.sheet_name,
+                                                                "gridProperties": {"rowCount": state.row_count}}}]})
+            elif rest.startswith("values/") and self.command == "GET":
+                a1 = rest[len("values/"):]
+                self.send_json(200, {"range": a1, "majorDimension": "ROWS", "values": state.read_range(a1)})
+            elif rest.startswith("values/") and self.command == "PUT":
+                a1 = rest[len("values/"):]
+                updated = state.write_range(a1, json.loads(body)["values"])
+                self.send_json(200, {"spreadsheetId": spreadsheet_id, "updatedRange": a1, "updatedCells": updated})
+            elif rest == "values:batchUpdate" and self.command == "POST":
+                data = json.loads(body)["data"]
+                updated = sum(state.write_range(item["range"], item["values"]) for item in data)
+                self.send_json(200, {"spreadsheetId": spreadsheet_id, "totalUpdatedCells": updated})
+            else:
+                self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+
+def start_stub_server(state: StubState, port: int = 0) -> ThreadingHTTPServer:
+    #port 0 picks a free port, the real one is in server.server_address
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--activities", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=120, help="days of activities and of sheet rows")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--fail-every", type=int, default=0, help="fail every nth strava request")
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    state = StubState(synthetic_activity_records(args.activities, days=args.days), synthetic_sheet(days=args.days),
+                      latency=args.latency, fail_every=args.fail_every, fail_status=args.fail_status)
+    server = start_stub_server(state, args.port)
+    print(f"Serving {args.activities} activities and a {args.days} day sheet on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
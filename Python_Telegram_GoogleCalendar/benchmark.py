@@ -0,0 +1,114 @@
+"""
+Benchmark of the google calendar formatter on synthetic months.
+
+Compares the old day x event loop (kept here as legacy_render) with calendar_format.render_month.
+The old loop also loses events because it deletes from the list it is looping over, so the number of event lines
+in each message is printed as well.
+
+Usage: python benchmark.py --events 1000 10000 50000
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from calendar_format import render_month
+
+TITLES = ["Lunch with Sam", "Dentist", "Hydro", "Movie night", "Dog training", "Office", "Travel to KL", "Brunch",
+          "Grocery run", "Vet: Bobo's jab", "Book club", "Car wash"]
+
+
+def synthetic_month(year: int, month: int, n: int, seed: int = 0) -> list:
+    #timed events in start time order, with a few full day and multi-day ones
+    rng = random.Random(seed)
+    first = datetime(year, month, 1)
+    days = ((first + timedelta(days=32)).replace(day=1) - first).days
+    events = []
+    for i, offset in enumerate(sorted(rng.randrange(days * 24 * 60) for _ in range(n))):
+        start = first + timedelta(minutes=offset)
+        if i % 50 == 0:
+            length = rng.randint(1, 3)
+            events.append({"id": f"e{i}", "summary": rng.choice(TITLES),
+                           "start": {"date": start.strftime("%Y-%m-%d")},
+                           "end": {"date": (start + timedelta(days=length)).strftime("%Y-%m-%d")}})
+            continue
+        end = start + timedelta(minutes=rng.choice([30, 60, 90, 120]))
+        events.append({"id": f"e{i}", "summary": rng.choice(TITLES),
+                       "start": {"dateTime": start.strftime("%Y-%m-%dT%H:%M:%S+08:00")},
+                       "end": {"dateTime": end.strftime("%Y-%m-%dT%H:%M:%S+08:00")}})
+    return events
+
+
+def legacy_render(month_text, year, date_range, events):
+    #the formatter from before calendar_format.py, only kept to compare against
+    events = list(events)
+    final_output = []
+    for generated_date in date_range:
+        final_output.append(generated_date)
+        count_events = 0
+        for event in events:
+            try:
+                event_date = event["start"].get("dateTime", event["start"].get("date")).split("T")[0]
+                start_time = event["start"].get("dateTime", event["start"].get("date")).split("T")[1].split("+")[0].split(":")[0] + event["start"].get("dateTime", event["start"].get("date")).split("T")[1].split("+")[0].split(":")[1]
+                end_time = event["end"].get("dateTime", event["end"].get("date")).split("T")[1].split("+")[0].split(":")[0] + event["end"].get("dateTime", event["end"].get("date")).split("T")[1].split("+")[0].split(":")[1]
+            except:
+                event_date = event["start"].get("date", event["start"].get("date"))
+                start_time = ""
+                end_time = ""
+            if str(event_date) == str(generated_date):
+                count_events=count_events+1
+                chars = re.escape(string.punctuation)
+                if event["summary"].lower() == "office" or "travel" in event["summary"].lower() or "vacuum" in event["summary"].lower() or "wash" in event["summary"].lower() or "walk" in event["summary"].lower() or "dinner" in event["summary"].lower() or "weights" in event["summary"].lower() or "smitty" in event["summary"].lower() or "shower" in event["summary"].lower() or "run" in event["summary"].lower():
+                    pass
+                else:
+                    final_output.append(re.sub('['+chars+']', ' ',event["summary"]) + " " + start_time + "\\-" + end_time)
+            else:
+                if count_events > 0:
+                    del events[:count_events]
+                    break
+    return  "*" + str(month_text).upper() + ' '+ str(year) + "*" + "\n" + "\n".join((x if bool(re.search("^([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])(\\.|-|/)([1-9]|0[1-9]|1[0-2])(\\.|-|/)([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])$|^([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])(\\.|-|/)([1-9]|0[1-9]|1[0-2])(\\.|-|/)([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])$",str(x))) == False else  "\n" + "*" + "\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-" + "\n \n" + str(pd.to_datetime(x,format='%Y-%m-%d').strftime('%d/%m')) + " " + datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") + "*" if datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") == "Mon" else "*" + "\n" + str(pd.to_datetime(x,format='%Y-%m-%d').strftime('%d/%m')) + " " + datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") + "*") for x in final_output)
+
+
+def timed(fn, *args, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def event_lines(message: str) -> int:
+    #lines that are events, not day labels, separators or blanks
+    return sum(1 for line in message.split("\n") if line.strip() and not line.startswith("*") and not line.endswith("*"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--month", default="sep 2024")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    first = datetime.strptime(args.month, "%b %Y").date()
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    date_range = np.arange(first.strftime("%Y-%m"), next_month.strftime("%Y-%m"), dtype="datetime64[D]")
+    month_text, year = args.month.split(" ")
+
+    print(f"{'events':>8} {'new (ms)':>10} {'legacy (ms)':>12} {'speedup':>8} {'new lines':>10} {'legacy lines':>13}")
+    for n in args.events:
+        events = synthetic_month(first.year, first.month, n)
+        new_time, new = timed(render_month, month_text, year, first, next_month, events, repeat=args.repeat)
+        legacy_time, legacy = timed(legacy_render, month_text, year, date_range, events, repeat=1)
+        print(f"{n:>8} {new_time * 1000:>10.1f} {legacy_time * 1000:>12.1f} {legacy_time / new_time:>7.1f}x "
+              f"{event_lines(new):>10} {event_lines(legacy):>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Formatter for the calendar messages, with only the standard library (datetime) so the bot starts without pandas/numpy.
+
+Every event is parsed exactly once into a small EventRecord (day, start, end, cleaned up title), then the events are
+grouped by day in a single pass, so the whole month costs O(days + events) instead of comparing every day against every
+event. Multi-day and full day events are put on every day of the month they cover.
+
+Events that should not be in the message (office, travel, vacuum ...) are filtered with one compiled pattern, built
+from exclusions.txt (or the file in the EXCLUSIONS_FILE environment variable). One keyword per line, a line starting
+with = has to match the whole title, eg. =office hides "Office" but not "Office party".
+"""
+
+import os.path
+import re
+import string
+from datetime import date, timedelta
+from functools import lru_cache
+
+from metrics import timed
+
+#punctuation is replaced with spaces so the title can't break the MarkdownV2 formatting
+PUNCTUATION = re.compile("[" + re.escape(string.punctuation) + "]")
+WEEK_SEPARATOR = "\\-" * 28
+EXCLUSIONS_FILE = os.environ.get("EXCLUSIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exclusions.txt"))
+
+
+class EventRecord:
+    __slots__ = ("first_day", "last_day", "start", "end", "title")
+
+    def __init__(self, first_day: date, last_day: date, start: str, end: str, title: str):
+        self.first_day = first_day  # first and last day the event is on, both inclusive
+        self.last_day = last_day
+        self.start = start  # hhmm, empty for full day events
+        self.end = end
+        self.title = title
+
+    def line(self) -> str:
+        if not self.start:
+            return self.title
+        return self.title + " " + self.start + "\\-" + self.end
+
+
+def load_exclusions(path: str = EXCLUSIONS_FILE):
+    #one compiled, case insensitive pattern for all the keywords in the file. None if there is nothing to exclude
+    if not os.path.exists(path):
+        return None
+    parts = []
+    with open(path, encoding="utf-8") as exclusions:
+        for line in exclusions:
+            keyword = line.strip()
+            if not keyword or keyword.startswith("#"):
+                continue
+            if keyword.startswith("="):
+                parts.append("^" + re.escape(keyword[1:].strip()) + "$")
+            else:
+                parts.append(re.escape(keyword))
+    return re.compile("|".join(parts), re.IGNORECASE) if parts else None
+
+
+EXCLUDED = load_exclusions()
+
+
+def parse_event(event: dict):
+    #dateTime looks like 2024-09-01T09:30:00+08:00, full day events only have date (and their end date is exclusive)
+    start = event.get("start", {})
+    end = event.get("end", {})
+    title = PUNCTUATION.sub(" ", event.get("summary", ""))
+    if "dateTime" in start:
+        start_time, end_time = start["dateTime"], end.get("dateTime", start["dateTime"])
+        first_day, last_day = date.fromisoformat(start_time[:10]), date.fromisoformat(end_time[:10])
+        if last_day > first_day and end_time[11:19] == "00:00:00":
+            # ends at midnight, so it is not on the next day
+            last_day -= timedelta(days=1)
+        return EventRecord(first_day, last_day, start_time[11:13] + start_time[14:16], end_time[11:13] + end_time[14:16], title)
+    if "date" in start:
+        first_day = date.fromisoformat(start["date"])
+        last_day = date.fromisoformat(end["date"]) - timedelta(days=1) if "date" in end else first_day
+        return EventRecord(first_day, max(last_day, first_day), "", "", title)
+    return None
+
+
+def group_by_day(events, first_day: date, next_month: date, excluded=EXCLUDED) -> dict:
+    #day -> list of EventRecord, in the order the events came in
+    grouped = {}
+    for event in events:
+        if excluded is not None and excluded.search(event.get("summary", "")):
+            # some events that I do not want to pass into the calendar
+            continue
+        record = parse_event(event)
+        if record is None:
+            continue
+        day = max(record.first_day, first_day)
+        last_day = min(record.last_day, next_month - timedelta(days=1))
+        while day <= last_day:
+            grouped.setdefault(day, []).append(record)
+            day += timedelta(days=1)
+    return grouped
+
+
+@lru_cache(maxsize=1024)
+def day_name(day: date) -> str:
+    #dd/mm and the short day name, eg. 01/09 Sun. built once per day and reused by every message
+    return day.strftime("%d/%m %a")
+
+
+def month_days(first_day: date, next_month: date):
+    day = first_day
+    while day < next_month:
+        yield day
+        day += timedelta(days=1)
+
+
+def day_label(day: date) -> str:
+    #date + day in bold, with the week separator above every monday
+    if day.weekday() == 0:
+        return "\n*" + WEEK_SEPARATOR + "\n \n" + day_name(day) + "*"
+    return "*\n" + day_name(day) + "*"
+
+
+def render_month(month_text: str, year, first_day: date, next_month: date, events, excluded=EXCLUDED) -> str:
+    """
+    The google calendar message for one month. events are the calendar api items, in start time order.
+    """
+    events = list(events)
+    if not events:
+        return "No upcoming events found\\." #escape the . because message is being sent using markdown
+
+    with timed("grouping"):
+        grouped = group_by_day(events, first_day, next_month, excluded)
+    with timed("render"):
+        output = ["*" + str(month_text).upper() + " " + str(year) + "*"]
+        for day in month_days(first_day, next_month):
+            output.append(day_label(day))
+            output.extend(record.line() for record in grouped.get(day, ()))
+        return "\n".join(output)
+
+
+def render_blank_month(month_text: str, year, first_day: date, next_month: date) -> str:
+    """
+    The month without google calendar events: the dates and days, with the week separator after every sunday.
+    The whole message is one bold block.
+    """
+    with timed("render"):
+        lines = []
+        for day in month_days(first_day, next_month):
+            lines.append(day_name(day) + "\n \n" + WEEK_SEPARATOR if day.weekday() == 6 else day_name(day))
+        return "*" + str(month_text).upper() + " " + str(year) + "\n \n" + "\n \n".join(lines) + "*"
+
+
+#telegram does not take messages longer than this
+MESSAGE_LIMIT = 4096
+#where a message can be cut without breaking the markdown, biggest pieces first: before a week separator, before a day
+CUT_POINTS = ("\n\n*" + WEEK_SEPARATOR, "\n*\n")
+
+
+def split_blocks(text: str, limit: int, cut_points=CUT_POINTS) -> list:
+    #pieces of text no longer than limit, cut at the first kind of cut point that is small enough
+    if len(text) <= limit:
+        return [text]
+    if not cut_points:
+        # a single day longer than a message, nothing left to do but cut at a line
+        cut = text.rfind("\n", 0, limit)
+        cut = cut if cut > 0 else limit
+        return [text[:cut]] + split_blocks(text[cut:].lstrip("\n"), limit, cut_points)
+    separator, smaller = cut_points[0], cut_points[1:]
+    blocks, start = [], 0
+    for index in _find_all(text, separator):
+        blocks.append(text[start:index])
+        start = index + 1  # the piece after keeps the rest of the separator, so joining with \n gives back the text
+    blocks.append(text[start:])
+    return [piece for block in blocks for piece in split_blocks(block, limit, smaller)]
+
+
+def _find_all(text: str, separator: str):
+    index = text.find(separator)
+    while index > 0:
+        yield index
+        index = text.find(separator, index + 1)
+
+
+def split_messages(months: list, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Packs the month messages (in order) into as few telegram messages as possible. A month that does not fit in one
+    message is cut at its week separators (or days, if a week is too long).
+    """
+    messages = []
+    for month in months:
+        for index, block in enumerate(split_blocks(month, limit)):
+            # a blank line between months, the pieces of a month go back together the way they were
+            joiner = "\n\n" if index == 0 else "\n"
+            if messages and len(messages[-1]) + len(joiner) + len(block) <= limit:
+                messages[-1] += joiner + block
+            else:
+                messages.append(block.lstrip("\n"))
+    return messages
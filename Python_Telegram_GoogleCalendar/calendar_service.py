@@ -0,0 +1,124 @@
+"""
+Long lived google calendar service for the bot.
+
+Before, every "refresh gc" message re-read token.json, could start the login flow, and called build("calendar", "v3")
+again, which parses the discovery document and builds the whole resource tree. That is hundreds of ms per message before
+any event is fetched. Now this is done once when the bot starts:
+- the credentials are loaded once, and a background thread refreshes the access token a few minutes before it expires
+  (and saves it back to token.json), so a request never has to wait for a token refresh
+- the service is built once from the discovery document that ships with google-api-python-client (static_discovery),
+  so it is read from disk and never downloaded
+- every request reuses the warmed service. The service's http object is not thread safe, so each calendar thread
+  gets its own authorized http connection
+- event listings follow nextPageToken to the last page (the api pages at 250 events by default, so a busy month used to
+  lose events), ask for the biggest page the api allows and only for the fields the bot uses
+"""
+
+import datetime
+import os.path
+import threading
+
+import logging
+
+import httplib2
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+
+from metrics import log_event, timed
+
+SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+#2500 is the most events.list gives back in one page
+PAGE_SIZE = 2500
+#partial response: only what the formatter and the month cache need. id and status are for the incremental sync
+EVENT_FIELDS = "items(id,status,summary,start,end),nextPageToken,nextSyncToken"
+
+
+class CalendarService:
+    def __init__(self, token_file: str = "token.json", client_secrets_file: str = "credentials.json",
+                 refresh_margin: float = 300, timeout: float = 30):
+        self.token_file = token_file
+        self.client_secrets_file = client_secrets_file
+        self.refresh_margin = refresh_margin  # seconds before expiry that the token is refreshed
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stopped = threading.Event()
+
+        self.creds = self._load_credentials()
+        self.service = build("calendar", "v3", credentials=self.creds, static_discovery=True)
+        self.refresher = threading.Thread(target=self._refresh_loop, name="calendar-token-refresh", daemon=True)
+        self.refresher.start()
+
+    def _load_credentials(self) -> Credentials:
+        creds = None
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        # If there are no (valid) credentials available, let the user log in.
+        elif not creds or not creds.valid:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                self.client_secrets_file, SCOPES
+            )
+            creds = flow.run_local_server(port=0)
+        self._save(creds)
+        return creds
+
+    def _save(self, creds: Credentials):
+        # Save the credentials for the next run
+        with open(self.token_file, "w") as token:
+            token.write(creds.to_json())
+
+    def seconds_until_refresh(self) -> float:
+        if self.creds.expiry is None:
+            return 3600
+        # expiry is a naive utc datetime
+        remaining = (self.creds.expiry - datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)).total_seconds()
+        # check again at least every hour, in case the clock or the token file changed
+        return min(max(remaining - self.refresh_margin, 0), 3600)
+
+    def refresh(self):
+        with self.lock, timed("credentials_refresh"):
+            self.creds.refresh(Request())
+            self._save(self.creds)
+
+    def _refresh_loop(self):
+        while not self.stopped.wait(self.seconds_until_refresh()):
+            try:
+                self.refresh()
+            except Exception as error:
+                # try again in a minute, AuthorizedHttp will still refresh on a 401 if it comes to that
+                log_event("token_refresh_failed", logging.WARNING, error=error)
+                if self.stopped.wait(60):
+                    return
+
+    def stop(self, timeout: float = 5):
+        #called when the bot shuts down, wakes the refresh thread up so it ends
+        self.stopped.set()
+        self.refresher.join(timeout)
+
+    def http(self) -> AuthorizedHttp:
+        #one authorized connection per calendar thread, reused for all of that thread's requests
+        if not hasattr(self.local, "http"):
+            self.local.http = AuthorizedHttp(self.creds, http=httplib2.Http(timeout=self.timeout))
+        return self.local.http
+
+    def list_events(self, **params) -> dict:
+        return self.service.events().list(**params).execute(http=self.http())
+
+    def event_pages(self, **params):
+        #yields every page of an events.list call. only the last page has the nextSyncToken
+        params.setdefault("maxResults", PAGE_SIZE)
+        params.setdefault("fields", EVENT_FIELDS)
+        while True:
+            page = self.list_events(**params)
+            yield page
+            if not page.get("nextPageToken"):
+                return
+            params["pageToken"] = page["nextPageToken"]
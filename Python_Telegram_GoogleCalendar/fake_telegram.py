@@ -0,0 +1,226 @@
+"""
+Local fake of the telegram bot api, to measure how long the bot takes to answer a message end to end.
+
+The fake answers the few bot api methods the bot uses (getMe, setWebhook, deleteWebhook, getUpdates, sendMessage).
+The bot is started as its own process with --base-url pointing at the fake. Then --messages blank calendar messages
+are sent to it, one every --gap seconds, either by POSTing them to the bot's webhook (with the secret token, like
+telegram does) or by handing them out on getUpdates. The latency is from when the message is sent to when the bot's
+sendMessage for that chat arrives. Blank calendars only, so no google credentials are needed.
+
+--poll-interval 3 gives the old polling setup (run_polling(poll_interval=3)) to compare against.
+
+Usage: python fake_telegram.py --mode webhook polling --messages 20
+       python fake_telegram.py --mode polling --poll-interval 3
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:fake"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Calendarize", "username": "calendarize_bot"}
+
+
+class FakeTelegram:
+    #what the fake has seen and what it still has to deliver, shared by the request handler threads
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.webhook = None  # (url, secret token) once the bot called setWebhook
+        self.polling = False
+        self.pending = []  # updates for getUpdates
+        self.next_update_id = 1
+        self.sent_at = {}  # chat id -> when the message to that chat was sent
+        self.latencies = []
+        self.calls = {}
+
+    def count(self, method: str):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def make_update(self, chat_id: int, text: str) -> dict:
+        with self.lock:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+        }}
+
+    def replied(self, chat_id: int):
+        with self.lock:
+            sent_at = self.sent_at.pop(chat_id, None)
+            if sent_at is not None:
+                self.latencies.append(time.perf_counter() - sent_at)
+            self.lock.notify_all()
+
+
+def read_params(handler: BaseHTTPRequestHandler) -> dict:
+    #the bot sends the parameters form encoded (values that are not strings are json) or as json
+    body = handler.rfile.read(int(handler.headers.get("Content-Length") or 0)).decode()
+    if not body:
+        return {}
+    if "json" in (handler.headers.get("Content-Type") or ""):
+        return json.loads(body)
+    params = {}
+    for key, value in urllib.parse.parse_qsl(body):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def make_handler(fake: FakeTelegram):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, result):
+            body = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            method = self.path.rstrip("/").split("/")[-1]
+            params = read_params(self)
+            fake.count(method)
+            if method == "getMe":
+                self.send_json(BOT_USER)
+            elif method == "setWebhook":
+                with fake.lock:
+                    fake.webhook = (params["url"], params.get("secret_token"))
+                    fake.lock.notify_all()
+                self.send_json(True)
+            elif method == "deleteWebhook":
+                self.send_json(True)
+            elif method == "getUpdates":
+                self.send_json(self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0)))
+            elif method == "sendMessage":
+                chat_id = int(params["chat_id"])
+                fake.replied(chat_id)
+                self.send_json({"message_id": 1, "date": int(time.time()), "text": params.get("text", ""),
+                                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER})
+            else:
+                self.send_json(True)
+
+        def get_updates(self, offset: int, timeout: float) -> list:
+            #long polling: hold the request until there is an update or the timeout runs out
+            deadline = time.monotonic() + timeout
+            with fake.lock:
+                fake.polling = True
+                fake.lock.notify_all()
+                fake.pending = [update for update in fake.pending if update["update_id"] >= offset]
+                while not fake.pending and time.monotonic() < deadline:
+                    fake.lock.wait(deadline - time.monotonic())
+                return list(fake.pending)
+
+    return Handler
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def deliver(fake: FakeTelegram, update: dict) -> int:
+    #webhook: POST it to the bot like telegram would, polling: leave it for the next getUpdates
+    chat_id = update["message"]["chat"]["id"]
+    with fake.lock:
+        fake.sent_at[chat_id] = time.perf_counter()
+        webhook = fake.webhook
+        if webhook is None:
+            fake.pending.append(update)
+            fake.lock.notify_all()
+            return 200
+    url, secret_token = webhook
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST", headers={
+        "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret_token or ""})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+
+def wrong_secret_status(fake: FakeTelegram) -> int:
+    #a request that does not come from telegram (wrong secret token) has to be turned away
+    url, _ = fake.webhook
+    request = urllib.request.Request(url, data=json.dumps(fake.make_update(999999, "sep 2024")).encode(), method="POST",
+                                     headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "wrong"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(mode: str, messages: int, gap: float, poll_interval: float) -> dict:
+    fake = FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api = f"http://127.0.0.1:{server.server_address[1]}/bot"
+
+    command = [sys.executable, "main.py", "--mode", mode, "--base-url", api, "--poll-interval", str(poll_interval)]
+    if mode == "webhook":
+        port = free_port()
+        command += ["--listen", "127.0.0.1", "--port", str(port), "--webhook-url", f"http://127.0.0.1:{port}/telegram"]
+    bot = subprocess.Popen(command, cwd=HERE, env={**os.environ, "TELEGRAM_TOKEN": TOKEN},
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with fake.lock:
+            ready = fake.lock.wait_for(lambda: fake.webhook if mode == "webhook" else fake.polling, timeout=30)
+        if not ready:
+            raise RuntimeError(f"the bot did not start in {mode} mode")
+        time.sleep(0.5)  # let the webhook server finish starting
+
+        rejected = wrong_secret_status(fake) if mode == "webhook" else None
+        for chat_id in range(messages):
+            deliver(fake, fake.make_update(chat_id, "sep 2024"))
+            time.sleep(gap)
+        with fake.lock:
+            fake.lock.wait_for(lambda: not fake.sent_at, timeout=30)
+        return {"latencies": fake.latencies, "calls": dict(fake.calls), "rejected": rejected}
+    finally:
+        bot.terminate()
+        bot.wait(10)
+        server.shutdown()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", nargs="+", choices=["webhook", "polling"], default=["webhook", "polling"])
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--gap", type=float, default=0.25, help="seconds between messages")
+    parser.add_argument("--poll-interval", type=float, default=0, help="passed on to the bot (polling mode)")
+    args = parser.parse_args()
+
+    for mode in args.mode:
+        result = run(mode, args.messages, args.gap, args.poll_interval)
+        latencies = [latency * 1000 for latency in result["latencies"]]
+        print(f"{mode}: {len(latencies)}/{args.messages} answered, latency ms p50 {statistics.median(latencies):.1f}, "
+              f"p95 {percentile(latencies, 0.95):.1f}, max {max(latencies):.1f}")
+        print(f"    bot api calls: {result['calls']}")
+        if result["rejected"] is not None:
+            print(f"    webhook with the wrong secret token got HTTP {result['rejected']}")
+
+
+if __name__ == "__main__":
+    main_cli()
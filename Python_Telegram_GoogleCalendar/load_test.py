@@ -0,0 +1,187 @@
+"""
+Load test for the google calendar path of the bot, without telegram or google.
+
+N "refresh gc <month>" updates from N different chats, each for a different month, are fired at the same time. The calendar backend is replaced by a stub
+that blocks for --latency seconds (like the real http call would) and returns synthetic events. If the calendar work
+blocked the event loop the wall time would be about N x latency, with the executor it should be about
+N / MAX_CALENDAR_CALLS x latency.
+
+With --range N a single "refresh gc jan 2020 - <N months later>" update is sent instead. The months are fetched at the
+same time, so the wall time should be about one fetch (as long as N <= MAX_CALENDAR_CALLS), not N of them.
+
+With --same-month every chat asks for the same month at the same time. They should all get the month from exactly one
+calendar call (single flight). With --burst N one chat sends N messages and commands at once, and only the rate
+limiter's burst of them should be answered. Both exit with 1 if that is not what happened.
+
+Usage: python load_test.py --updates 20 --latency 0.5
+       python load_test.py --range 3 --latency 0.5
+       python load_test.py --updates 50 --same-month
+       python load_test.py --burst 30
+"""
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from telegram.ext import ApplicationHandlerStop
+
+import main
+
+COMMANDS = {"/googlecalendar": main.google_calendar_command, "/blankcalendar": main.blank_calendar_command,
+            "/stats": main.stats_command}
+
+
+def synthetic_events(time_min: str, time_max: str, per_day: int = 5, seed: int = 0) -> list:
+    #timed events spread over the month, in start time order like the api returns them
+    rng = random.Random(seed)
+    first = datetime.strptime(time_min[:10], "%Y-%m-%d")
+    last = datetime.strptime(time_max[:10], "%Y-%m-%d")
+    events = []
+    day = first
+    while day < last:
+        for hour in sorted(rng.sample(range(7, 22), per_day)):
+            start = day + timedelta(hours=hour)
+            end = start + timedelta(minutes=rng.choice([30, 60, 90]))
+            events.append({
+                "id": f"event{len(events)}",
+                "summary": rng.choice(["Lunch with Sam", "Dentist", "Hydro", "Movie night", "Dog training", "Brunch"]),
+                "start": {"dateTime": start.strftime("%Y-%m-%dT%H:%M:%S+08:00")},
+                "end": {"dateTime": end.strftime("%Y-%m-%dT%H:%M:%S+08:00")},
+            })
+        day += timedelta(days=1)
+    return events
+
+
+class StubCalendar:
+    #stands in for main.fetch_calendar_events, counts the calls and how many were in flight at once
+    #it gives no sync token, so the month cache serves repeats of a month without calling it again
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.threads = set()  # thread name prefixes the calls ran on
+        self.lock = threading.Lock()
+
+    def __call__(self, calendar_id: str, time_min: str, time_max: str) -> tuple:
+        with self.lock:
+            self.calls += 1
+            self.threads.add(threading.current_thread().name.split("_")[0])
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return synthetic_events(time_min, time_max), None
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, chat_type: str = "private"):
+        self.id = chat_id
+        self.type = chat_type
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int, text: str, chat_type: str = "private"):
+        self.chat = FakeChat(chat_id, chat_type)
+        self.text = text
+        self.replies = []
+        self.replied_at = None
+
+    async def reply_text(self, text: str, parse_mode: str = None):
+        self.replies.append(text)
+        self.replied_at = time.perf_counter()
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, text: str, chat_type: str = "private"):
+        self.message = FakeMessage(chat_id, text, chat_type)
+        self.effective_message = self.message
+        self.effective_user = None
+
+
+async def dispatch(update: FakeUpdate):
+    #what the application does with an update: the rate limit first (group -1), then the command or message handler
+    try:
+        await main.rate_limit(update, None)
+    except ApplicationHandlerStop:
+        return
+    text = update.message.text
+    handler = COMMANDS[text.split()[0]] if text.startswith("/") else main.handle_message
+    await handler(update, None)
+
+
+async def fire(updates: list) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(dispatch(update) for update in updates))
+    return time.perf_counter() - started
+
+
+def month_name(n: int) -> str:
+    #jan 2020, feb 2020, ... a different month for every n
+    return datetime(2020 + n // 12, n % 12 + 1, 1).strftime("%b %Y").lower()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20, help="number of simultaneous refresh gc updates")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds each stubbed calendar call takes")
+    parser.add_argument("--range", type=int, default=0, help="send one update for a range of this many months instead")
+    parser.add_argument("--same-month", action="store_true", help="every chat asks for the same month")
+    parser.add_argument("--burst", type=int, default=0, help="send this many updates from one chat instead")
+    args = parser.parse_args()
+
+    stub = StubCalendar(args.latency)
+    main.fetch_calendar_events = stub
+    if args.range:
+        update = FakeUpdate(0, f"refresh gc {month_name(0)} - {month_name(args.range - 1)}")
+        wall_time = asyncio.run(fire([update]))
+        replies = update.message.replies
+        print(f"months: {args.range}, calendar calls: {stub.calls}, max in flight: {stub.max_in_flight} (cap {main.MAX_CALENDAR_CALLS})")
+        print(f"replies: {len(replies)}, longest: {max(map(len, replies))} characters")
+        print(f"wall time: {wall_time:.2f}s, one month after the other it would be {args.range * args.latency:.2f}s")
+        return
+    if args.burst:
+        #messages and commands mixed, the limit is for everything the chat sends
+        updates = [FakeUpdate(0, "/googlecalendar" if n % 2 else f"refresh gc {month_name(n)}") for n in range(args.burst)]
+        wall_time = asyncio.run(fire(updates))
+        replied = sum(1 for update in updates if update.message.replies)
+        expected = min(args.burst, main.rate_limiter.burst)
+        print(f"updates from one chat: {args.burst}, replied: {replied}, dropped: {args.burst - replied} "
+              f"(burst {main.rate_limiter.burst}), calendar calls: {stub.calls}")
+        if replied != expected:
+            raise SystemExit(f"FAIL: {replied} updates were answered, the rate limit should let exactly {expected} through")
+        return
+    if args.same_month:
+        #different spellings of the same month, they are all one request
+        spellings = ["refresh gc sep 2024", "refresh gc SEP 2024", "refresh gc Sep  2024", "Refresh  GC\tsep 2024"]
+        updates = [FakeUpdate(chat_id, spellings[chat_id % len(spellings)]) for chat_id in range(args.updates)]
+        wall_time = asyncio.run(fire(updates))
+        replied = sum(1 for update in updates if update.message.replies)
+        same = len({update.message.replies[0] for update in updates if update.message.replies})
+        print(f"updates: {args.updates}, replied: {replied}, different replies: {same}, calendar calls: {stub.calls}, "
+              f"coalesced: {main.metrics.snapshot()['counters'].get('coalesced', 0)}")
+        print(f"wall time: {wall_time:.2f}s")
+        #the calendar work has to run on calendar_executor, never on the event loop
+        if stub.calls != 1 or replied != args.updates or same != 1 or stub.threads != {"calendar"}:
+            raise SystemExit(f"FAIL: {args.updates} identical requests should make exactly 1 calendar call, on calendar_executor, and all get the same reply")
+        return
+
+    #every chat asks for a different month, so each one is a cache miss that needs a calendar call
+    updates = [FakeUpdate(chat_id, f"refresh gc {month_name(chat_id)}") for chat_id in range(args.updates)]
+    wall_time = asyncio.run(fire(updates))
+
+    replied = sum(1 for update in updates if update.message.replies)
+    serial_time = args.updates * args.latency
+    print(f"updates: {args.updates}, replied: {replied}, calendar calls: {stub.calls}, "
+          f"max in flight: {stub.max_in_flight} (cap {main.MAX_CALENDAR_CALLS})")
+    print(f"wall time: {wall_time:.2f}s, one after the other it would be {serial_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main_cli()
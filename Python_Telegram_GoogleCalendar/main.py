@@ -16,225 +16,339 @@ separate out the weeks of the month with -------------
 #telegram dependencies
 from typing import Final #a final type means that the variable cannot be reassigned to another value
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from datetime import datetime
-import numpy as np
-import pandas as pd
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+import argparse
+import asyncio
+import logging
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-#google dependencies
+#google dependencies. googleapiclient and google.auth take about a third of a second to import, so they are only
+#imported when the calendar service is made (in the background when the bot starts), see get_calendar_service
 import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
-#string dependencies 
-import string
-import re
+from month_cache import MonthCache
+from calendar_format import render_month, render_blank_month, split_messages
+from metrics import metrics, timed, log_event, start_metrics_server
+from throttling import SingleFlight, ChatRateLimiter
  
-TOKEN: Final = '' #token and username hidden for privacy
+TOKEN: Final = os.environ.get("TELEGRAM_TOKEN", '') #token and username hidden for privacy
 BOT_USERNAME: Final = ''
 
+#google calendar calls are blocking, so they run on this pool and the bot keeps serving other chats meanwhile
+#the size of the pool is also the cap on how many calendar calls can be in flight at the same time
+MAX_CALENDAR_CALLS: Final = int(os.environ.get("MAX_CALENDAR_CALLS", 4))
+#how many updates the bot works on at the same time, the default in telegram is one after the other
+MAX_CONCURRENT_UPDATES: Final = int(os.environ.get("MAX_CONCURRENT_UPDATES", 32))
+calendar_executor = ThreadPoolExecutor(max_workers=MAX_CALENDAR_CALLS, thread_name_prefix="calendar")
+#the months are from the 1st 00:00 to the next 1st 00:00 in this timezone, and the event times are shown in it
+CALENDAR_TIMEZONE: Final = os.environ.get("CALENDAR_TIMEZONE", "Asia/Singapore")
+#the most months one range (eg. sep 2024 - nov 2024) can ask for
+MAX_RANGE_MONTHS: Final = int(os.environ.get("MAX_RANGE_MONTHS", 12))
+#telegram user ids that can use /stats, eg. ADMIN_IDS=12345,67890
+ADMIN_IDS: Final = {int(user_id) for user_id in os.environ.get("ADMIN_IDS", "").split(",") if user_id.strip()}
+RANGE_PATTERN = re.compile(r"^(refresh\s+gc\s+)?([a-z]{3}\s+\d{4})\s*-\s*([a-z]{3}\s+\d{4})$")
+#identical google calendar requests that come in at the same time share one calendar call and render
+calendar_requests = SingleFlight()
+#messages a chat can send, a burst of RATE_LIMIT_BURST and then RATE_LIMIT_PER_MINUTE. the rest are dropped
+rate_limiter = ChatRateLimiter(
+    per_minute=float(os.environ.get("RATE_LIMIT_PER_MINUTE", 20)),
+    burst=int(os.environ.get("RATE_LIMIT_BURST", 5)),
+)
+
 #commands. these are the ones that start with /
 #async is used in the api to make the commands asynchronous 
 async def start_command(update: Update, context:ContextTypes.DEFAULT_TYPE):
     #for codes, insert the logic here, then reply will be at the end
-    await update.message.reply_text("Hello! I will help to generate your monthly calendar, please submit your desired month in format month year, Eg. Sep 2024. If you're calling me from a group chat, please start the text with \"calendarize\". If you use \"calendarize refresh gc\" with the month year, pai's google calendar events will be displayed. Eg. calendarize refresh gc sep 2024") #this will be the text that the bot will say when the user clicks on start
+    await update.message.reply_text("Hello! I will help to generate your monthly calendar, please submit your desired month in format month year, Eg. Sep 2024, or a range of months, Eg. Sep 2024 - Nov 2024. If you're calling me from a group chat, please start the text with \"calendarize\". If you use \"calendarize refresh gc\" with the month year, pai's google calendar events will be displayed. Eg. calendarize refresh gc sep 2024") #this will be the text that the bot will say when the user clicks on start
 
 async def blank_calendar_command(update: Update, context:ContextTypes.DEFAULT_TYPE):
     new_text = datetime.today().strftime("%b %Y")
-    await update.message.reply_text(handle_response(new_text),parse_mode='MarkdownV2')
+    await send_responses(update, await respond_parts(new_text))
     
 async def google_calendar_command(update: Update, context:ContextTypes.DEFAULT_TYPE):
     new_text = datetime.today().strftime("%b %Y")
-    await update.message.reply_text(handle_response("refresh gc " + new_text),parse_mode='MarkdownV2')
+    await send_responses(update, await respond_parts("refresh gc " + new_text))
     
-#handle the responses -> bot can process what the user is typing
-def handle_response(text: str) -> str: #will take an input of type string, and return string
-    processed: str = text.lower() #py is a case sensitive language
-    if "refresh gc" in processed:
-        processed = processed.lower().replace("refresh gc", '').strip()
-        # print(processed)
-        bool_calendar = True
-    else:
-        bool_calendar = False
-    
-    format = "%b %Y" #expected month year eg. nov 2024
-    # checking if format matches the date 
-    res = True
+#created once in __main__ (or on the first request), so the credentials and the service are reused by every message
+calendar_service = None
+calendar_service_lock = threading.Lock()
+
+def get_calendar_service():
+    global calendar_service
+    with calendar_service_lock:
+        if calendar_service is None:
+            from calendar_service import CalendarService
+            with timed("credentials"):
+                calendar_service = CalendarService()
+    return calendar_service
+
+#google calendar. this is blocking (http), so the bot runs it on calendar_executor and not on the event loop
+#no orderBy, it can't be used together with sync tokens. month_cache sorts the events itself
+def fetch_calendar_events(calendar_id: str, time_min: str, time_max: str) -> tuple:
+    service = get_calendar_service()
+    with timed("calendar_fetch"):
+        return collect_pages(service.event_pages(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            timeZone=CALENDAR_TIMEZONE, #the formatter reads the hh:mm straight out of the dateTime, so it has to be in our timezone
+            singleEvents=True,
+        ))
+
+#only the events that changed since the sync token was given out
+def fetch_calendar_changes(calendar_id: str, sync_token: str) -> tuple:
+    service = get_calendar_service()
+    with timed("calendar_sync"):
+        return collect_pages(service.event_pages(
+            calendarId=calendar_id,
+            syncToken=sync_token,
+            timeZone=CALENDAR_TIMEZONE,
+            singleEvents=True,
+        ))
+
+#the items of every page as they come in, and the sync token from the last page
+def collect_pages(pages) -> tuple:
+    items, sync_token = [], None
+    for page in pages:
+        items.extend(page.get("items", []))
+        sync_token = page.get("nextSyncToken", sync_token)
+    return items, sync_token
+
+#rfc3339 start of the month and of the next month, in CALENDAR_TIMEZONE (so daylight saving is right too)
+def month_bounds(first_day: date, next_month_day: date) -> tuple:
+    timezone = ZoneInfo(CALENDAR_TIMEZONE)
+    return (datetime(first_day.year, first_day.month, 1, tzinfo=timezone).isoformat(),
+            datetime(next_month_day.year, next_month_day.month, 1, tzinfo=timezone).isoformat())
+
+#rendered months, refreshed with sync tokens. the lambdas look the fetch functions up on every call so they can be swapped out in load_test.py
+month_cache = MonthCache(
+    lambda *args: fetch_calendar_events(*args),
+    lambda *args: fetch_calendar_changes(*args),
+    max_months=int(os.environ.get("MONTH_CACHE_SIZE", 24)),
+    ttl=float(os.environ.get("MONTH_CACHE_TTL", 6 * 3600)),
+)
+
+#latency of every stage (p50/p95/p99 in ms), the counters and the month cache (hits are served with only an incremental
+#sync call, misses download the whole month). only for the ADMIN_IDS
+async def stats_command(update: Update, context:ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        log_event("stats_denied", user=getattr(user, "id", None))
+        return
+    cache = ", ".join(f"{name} {count}" for name, count in month_cache.stats().items())
+    await update.message.reply_text(metrics.report() + "\nmonth cache: " + cache)
+
+#lower case with single spaces, so "Refresh  GC\tsep 2024" is the same request as "refresh gc sep 2024" everywhere
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+#runs handle_response without blocking the event loop: the google calendar ones go to calendar_executor,
+#the blank calendar is quick enough to build right here
+async def respond(text: str) -> str:
+    text = normalize(text)
+    if "refresh gc" in text:
+        loop = asyncio.get_running_loop()
+        key = request_key(text)
+        if key is None:
+            return handle_response(text) #not a month, nothing to fetch
+        response, coalesced = await calendar_requests.run(key, lambda: loop.run_in_executor(calendar_executor, handle_response, text))
+        if coalesced:
+            metrics.increment("coalesced")
+        return response
+    return handle_response(text)
+
+#("gc", 9, 2024) for "refresh gc sep 2024" however it is spelled, None if it is not a month
+def request_key(text: str):
+    processed = normalize(normalize(text).replace("refresh gc", ''))
     try:
-        res = bool(datetime.strptime(processed, format))
+        month = datetime.strptime(processed, "%b %Y")
     except ValueError:
-        res = False
+        return None
+    return ("gc", month.month, month.year)
+
+#"refresh gc sep 2024 - nov 2024" -> ["refresh gc sep 2024", "refresh gc oct 2024", "refresh gc nov 2024"]
+#anything that is not a range comes back as it is, and None if the range is the wrong way round or too long
+def expand_range(text: str):
+    match = RANGE_PATTERN.match(text.lower().strip())
+    if match is None:
+        return [text]
+    prefix = "refresh gc " if match.group(1) else ""
+    try:
+        first = datetime.strptime(match.group(2), "%b %Y")
+        last = datetime.strptime(match.group(3), "%b %Y")
+    except ValueError:
+        return [text] #not a month, handle_response will say the format is wrong
+    count = (last.year - first.year) * 12 + last.month - first.month + 1
+    if count < 1 or count > MAX_RANGE_MONTHS:
+        return None
+    return [prefix + date(first.year + (first.month - 1 + n) // 12, (first.month - 1 + n) % 12 + 1, 1).strftime("%b %Y").lower()
+            for n in range(count)]
+
+#the messages to send back: the months of a range are worked on at the same time (each google calendar month is its own
+#calendar call), then put back in order and packed into as few telegram messages as possible
+async def respond_parts(text: str) -> list:
+    text = normalize(text)
+    months = expand_range(text)
+    if months is None:
+        return [f"Please ask for a range of at most {MAX_RANGE_MONTHS} months, from the earlier month to the later one. Eg. sep 2024 - nov 2024"]
+    responses = await asyncio.gather(*(respond(month) for month in months))
+    if any("Date is not in the correct format" in response for response in responses):
+        return [responses[0] if len(responses) == 1 else "Date is not in the correct format, please submit the range again as month year - month year. Eg. sep 2024 - nov 2024"]
+    return split_messages(responses)
+
+#sends the parts from respond_parts one after the other, so the parts of a range (or of a long month) arrive in order
+async def send_responses(update: Update, responses: list):
+    for response in responses:
+        with timed("reply"):
+            if "Date is not in the correct format" in response or "Please ask for a range" in response:
+                await update.message.reply_text(response)
+            else:
+                await update.message.reply_text(response, parse_mode='MarkdownV2')
+    metrics.increment("replies", len(responses))
+
+#handle the responses -> bot can process what the user is typing
+def handle_response(text: str) -> str: #will take an input of type string, and return string
+    with timed("parse"):
+        processed: str = " ".join(text.lower().split()) #py is a case sensitive language. extra spaces are dropped so "sep  2024" has a year too
+        if "refresh gc" in processed:
+            processed = processed.lower().replace("refresh gc", '').strip()
+            # print(processed)
+            bool_calendar = True
+        else:
+            bool_calendar = False
+
+        format = "%b %Y" #expected month year eg. nov 2024
+        # checking if format matches the date
+        res = True
+        try:
+            res = bool(datetime.strptime(processed, format))
+        except ValueError:
+            res = False
     # print(res)
     # print(bool_calendar)
     if res == True:
         # if the format is correct, we want to take the month, change it to integer and take the date
+        month_text: str = processed.split(" ")[0]
+        year: int = processed.split(" ")[1]
+        # get current month, get next month
+        first_day = datetime.strptime(processed, format).date()
+        next_month_day = date(first_day.year + first_day.month // 12, first_day.month % 12 + 1, 1)
         if bool_calendar == False:
-            month_text: str = processed.split(" ")[0]
-            year: int = processed.split(" ")[1]
-            # get current month, get next month
-            first_month = int(pd.to_datetime(month_text,format='%b').strftime('%m'))
-            if first_month == 12:
-                next_month = 1
-                next_year = int(year)+1
-            else:
-                next_month = first_month+1
-                next_year = year
-        
-            second_date = pd.to_datetime(str(next_month)+' '+str(next_year),format='%m %Y').strftime('%Y-%m')
-            first_date = pd.to_datetime(processed,format='%b %Y').strftime('%Y-%m')
-            # return second_date
-            date_range = np.arange(first_date, second_date,dtype='datetime64[D]')
             # if day is sun, join the date with the line separator. encase the start and end of the string with * to make it bold
-            return "*" + str(month_text).upper() + ' '+ str(year) + "\n \n" + "\n \n".join(str(pd.to_datetime(x,format='%Y-%m-%d').strftime('%d/%m')) + ' ' + (datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") +"\n \n" + "\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-" if datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") == "Sun" else datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a")) for x in date_range) + "*"
+            return render_blank_month(month_text, year, first_day, next_month_day)
         else:
-            month_text: str = processed.split(" ")[0]
-            year: int = processed.split(" ")[1]
-            #get current month, get next month
-            first_month = int(pd.to_datetime(month_text,format='%b').strftime('%m'))
-            if first_month == 12:
-                next_month = 1
-                next_year = int(year)+1
-            else:
-                next_month = first_month+1
-                next_year = year
-            # print (processed)
-            # print(str(next_month)+' '+str(next_year))
-                
-            first_date = pd.to_datetime(processed,format='%b %Y').strftime('%Y-%m')
-            #'%Y-%m-01T00:00:01+08:00'
-            second_date = pd.to_datetime(str(next_month)+' '+str(next_year),format='%m %Y').strftime('%Y-%m')
-            date_range = np.arange(first_date, second_date,dtype='datetime64[D]')
-
-            SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
-            """Shows basic usage of the Google Calendar API.
-            Prints the start and name of the next 10 events on the user's calendar.
-            """
-            creds = None
-            # The file token.json stores the user's access and refresh tokens, and is
-            # created automatically when the authorization flow completes for the first
-            # time.
-            if os.path.exists("token.json"):
-                creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-            # If there are no (valid) credentials available, let the user log in.
-            if not creds or not creds.valid:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    "credentials.json", SCOPES
-                )
-                creds = flow.run_local_server(port=0)
-                # Save the credentials for the next run
-                with open("token.json", "w") as token:
-                    token.write(creds.to_json())
-
+            from googleapiclient.errors import HttpError
             try:
-                service = build("calendar", "v3", credentials=creds)
-
-                events_result = (
-                    service.events()
-                    .list(
-                        calendarId="primary",
-                        timeMin=first_date+"-01T00:00:00+08:00", # user defined date only has the month year, append 1st of the month to it
-                        timeMax = second_date+"-01T00:00:00+08:00",
-                        singleEvents=True,
-                        orderBy="startTime",
-                    )
-                    .execute()
-                )
-                events = events_result.get("items", [])
-
-                if not events: 
-                    return "No upcoming events found\." #escape the . because message is being sent using markdown
-
-                final_output = []
-                # loop through the list of dates in the month, then loop through the calendar events. if the events match the date, push the event into the output
-                # count the number of events for the day and remove these from the list of events so that the traversing time will not be as long
-                
-                for generated_date in date_range:
-                    # print(generated_date)
-                    final_output.append(generated_date)
-                    # print(final_output)
-                    count_events = 0
-                    # if len(events) > 0:
-                    for event in events:
-                        try:
-                            event_date = event["start"].get("dateTime", event["start"].get("date")).split("T")[0]
-                            start_time = event["start"].get("dateTime", event["start"].get("date")).split("T")[1].split("+")[0].split(":")[0] + event["start"].get("dateTime", event["start"].get("date")).split("T")[1].split("+")[0].split(":")[1]
-                            end_time = event["end"].get("dateTime", event["end"].get("date")).split("T")[1].split("+")[0].split(":")[0] + event["end"].get("dateTime", event["end"].get("date")).split("T")[1].split("+")[0].split(":")[1]
-                        except: #event will not have datetime if this is a full day event, try except to handle this
-                            event_date = event["start"].get("date", event["start"].get("date"))
-                            start_time = ""
-                            end_time = ""
-                        # print(event["summary"], event_date, start_time, end_time)
-                        # print(event_date)
-                        
-                        if str(event_date) == str(generated_date):
-                            # print("trues")
-                            count_events=count_events+1
-                            chars = re.escape(string.punctuation)
-                            # print re.sub('['+chars+']', '',event["summary"])
-                            
-                            # some events that I do not want to pass into the calendar
-                            if event["summary"].lower() == "office" or "travel" in event["summary"].lower() or "vacuum" in event["summary"].lower() or "wash" in event["summary"].lower() or "walk" in event["summary"].lower() or "dinner" in event["summary"].lower() or "weights" in event["summary"].lower() or "smitty" in event["summary"].lower() or "shower" in event["summary"].lower() or "run" in event["summary"].lower():
-                                pass
-                            else:
-                                final_output.append(re.sub('['+chars+']', ' ',event["summary"]) + " " + start_time + "\-" + end_time)
-                            # print(event["summary"])
-                            # print(final_output)
-                            # print(len(final_output))
-                        else:
-                            # print("false")
-                            # print(count_events)
-                            if count_events > 0:
-                                del events[:count_events]
-                                # print(len(events))
-                                break
-                    # print(final_output)
-                # loop through the list, if it cannot be parsed as a date, append it as it is. Else, if the day is monday, add the line separator above it + date + day in bold
-                # else, add the date+day in bold
-                return  "*" + str(month_text).upper() + ' '+ str(year) + "*" + "\n" + "\n".join((x if bool(re.search("^([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])(\.|-|/)([1-9]|0[1-9]|1[0-2])(\.|-|/)([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])$|^([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])(\.|-|/)([1-9]|0[1-9]|1[0-2])(\.|-|/)([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])$",str(x))) == False else  "\n" + "*" + "\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-" + "\n \n" + str(pd.to_datetime(x,format='%Y-%m-%d').strftime('%d/%m')) + " " + datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") + "*" if datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") == "Mon" else "*" + "\n" + str(pd.to_datetime(x,format='%Y-%m-%d').strftime('%d/%m')) + " " + datetime.strptime(str(x), "%Y-%m-%d").date().strftime("%a") + "*") for x in final_output)
+                time_min, time_max = month_bounds(first_day, next_month_day)
+                return month_cache.get("primary", time_min, time_max, lambda events: render_month(month_text, year, first_day, next_month_day, events))
             except HttpError as error:
-                print(f"An error occurred: {error}")
+                metrics.increment("calendar_errors")
+                log_event("calendar_error", logging.WARNING, error=str(error))
+                return "Could not get the Google Calendar events, please try again later\\."
     else:
         return "Date is not in the correct format, please submit the date again in month (short form) year. Eg. sep 2024"
     
+#runs before every other handler (group -1), so commands are limited too. group chatter the bot does not answer
+#is let through without using up the chat's messages
+async def rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.effective_message
+    if message is None or message.text is None:
+        return
+    text = message.text.lower()
+    if message.chat.type == 'group' and not text.startswith("/") and "calendarize" not in text:
+        return
+    if not rate_limiter.allow(message.chat.id):
+        metrics.increment("shed")
+        log_event("shed", chat=message.chat.id, chat_type=message.chat.type)
+        raise ApplicationHandlerStop #too many messages from this chat, no other handler gets it
+
 #this portion will allow the bot to send back the messsage into the chat
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_type: str = update.message.chat.type #inform us whether it's a private chat or a group chat. we don't want the bot to respond unless the user is directly talking to it
     text:str = update.message.text #the message that is incoming
 
-    print(f'User ({update.message.chat.id}) in {message_type}: "{text}"')
+    if message_type == 'group' and "calendarize" not in text.lower():
+        return #bot shouldn't respond
 
+    started = time.perf_counter()
+    metrics.increment("messages")
     if message_type == 'group':
-        if "calendarize" in text.lower():
-            new_text: str = text.lower().replace("calendarize", '').strip() #we don't want to process the bot name in the text. strip is to trim the edge whitespaces
-            response: str = handle_response(new_text)
-        else:
-            return #bot shouldn't respond
+        new_text: str = text.lower().replace("calendarize", '').strip() #we don't want to process the bot name in the text. strip is to trim the edge whitespaces
+        responses: list = await respond_parts(new_text)
     else:
-        response: str = handle_response(text)
-    
-    print ('Bot:', response)
-    
-    if "Date is not in the correct format" in response:
-        await update.message.reply_text(response)
-    else:
-        await update.message.reply_text(response, parse_mode='MarkdownV2')
+        responses: list = await respond_parts(text)
+
+    await send_responses(update, responses)
+    metrics.observe("message", time.perf_counter() - started)
+    #the sizes and not the text, so the log stays small however long the month is
+    log_event("message", chat=update.message.chat.id, chat_type=message_type, text=text[:64], parts=len(responses),
+              characters=sum(map(len, responses)), ms=round((time.perf_counter() - started) * 1000, 1))
 
 #error handler
 async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    print(f'Update {update} caused the following error {context.error}')
+    metrics.increment("errors")
+    log_event("update_error", logging.ERROR, update=update, error=context.error)
+
+#log in to google in the background, a bot without google credentials can still do blank calendars
+def warm_up_calendar_service():
+    try:
+        get_calendar_service()
+    except Exception as error:
+        log_event("calendar_not_ready", logging.WARNING, error=error) #tried again on the first google calendar message
+
+#stops the token refresh thread when the bot shuts down
+async def stop_calendar_service(application: Application):
+    if calendar_service is not None:
+        calendar_service.stop()
+
+#how the bot gets its messages. webhook: telegram posts every update to us as soon as it comes in, polling: we ask
+#telegram for updates and the request is held open (long polling) until there is one or timeout runs out
+def parse_args():
+    parser = argparse.ArgumentParser(description="Calendar telegram bot")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=os.environ.get("BOT_MODE", "polling"))
+    parser.add_argument("--concurrent-updates", type=int, default=MAX_CONCURRENT_UPDATES, help="updates worked on at the same time")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT", 0)), help="serve /metrics for prometheus on this port, off if 0")
+    parser.add_argument("--base-url", default=os.environ.get("TELEGRAM_BASE_URL"), help="bot api url, eg. a local fake telegram server (see fake_telegram.py)")
+    #webhook
+    parser.add_argument("--webhook-url", default=os.environ.get("WEBHOOK_URL"), help="public https url telegram posts the updates to")
+    parser.add_argument("--listen", default=os.environ.get("WEBHOOK_LISTEN", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("WEBHOOK_PORT", 8443)))
+    parser.add_argument("--url-path", default=os.environ.get("WEBHOOK_PATH", "telegram"))
+    parser.add_argument("--max-connections", type=int, default=int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40)), help="connections telegram opens to the webhook at the same time")
+    #polling
+    parser.add_argument("--poll-timeout", type=int, default=int(os.environ.get("POLL_TIMEOUT", 30)), help="seconds telegram holds a getUpdates open")
+    parser.add_argument("--poll-interval", type=float, default=float(os.environ.get("POLL_INTERVAL", 0)), help="seconds to wait between getUpdates")
+    return parser.parse_args()
 
 #putting it all together
 if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING) #otherwise every getUpdates and sendMessage is logged
     print('Starting bot')
-    app = Application.builder().token(TOKEN).build()
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    #log in to google and build the calendar service once. it is done in the background so the bot can start answering
+    #(blank calendars) straight away, a google calendar message that comes in before it is ready waits for it
+    threading.Thread(target=warm_up_calendar_service, name="calendar-service-warmup", daemon=True).start()
+    builder = Application.builder().token(TOKEN).concurrent_updates(args.concurrent_updates).post_shutdown(stop_calendar_service)
+    if args.base_url:
+        builder = builder.base_url(args.base_url)
+    app = builder.build()
+
+    #per chat rate limit, before any of the handlers below
+    app.add_handler(TypeHandler(Update, rate_limit), group=-1)
 
     #commands
     app.add_handler(CommandHandler('start', start_command)) #put in your commands
     app.add_handler(CommandHandler('blankcalendar', blank_calendar_command))
     app.add_handler(CommandHandler('googlecalendar', google_calendar_command))
+    app.add_handler(CommandHandler('stats', stats_command))
 
     #messages
     app.add_handler(MessageHandler(filters.TEXT, handle_message))
@@ -242,7 +356,23 @@ if __name__ == "__main__":
     #errors
     app.add_error_handler(error)
 
-    #polling - for bot to continually check for messages
-    print('polling')
-    app.run_polling(poll_interval=3) #unit is in seconds
-
+    if args.mode == "webhook":
+        if not args.webhook_url:
+            raise SystemExit("webhook mode needs --webhook-url (or WEBHOOK_URL)")
+        #telegram sends this back in the X-Telegram-Bot-Api-Secret-Token header, requests without it are turned away
+        secret_token = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+        print(f'webhook on {args.listen}:{args.port}/{args.url_path}')
+        app.run_webhook(
+            listen=args.listen,
+            port=args.port,
+            url_path=args.url_path,
+            webhook_url=args.webhook_url,
+            secret_token=secret_token,
+            max_connections=args.max_connections,
+            drop_pending_updates=False,
+        )
+    else:
+        #polling - for bot to continually check for messages. the request waits at telegram until a message comes in,
+        #so a message is answered straight away instead of at the next poll
+        print('polling')
+        app.run_polling(timeout=args.poll_timeout, poll_interval=args.poll_interval) #unit is in seconds
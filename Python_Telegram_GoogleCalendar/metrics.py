@@ -0,0 +1,146 @@
+"""
+In memory latency histograms and counters for the bot, and sampled structured logging.
+
+Every stage of a message (parsing, credentials, calendar fetch, grouping, rendering, reply) is timed with
+`with timed("stage"):`. Each stage keeps a prometheus style histogram (fixed buckets, count and sum, so memory does not
+grow) and the last RECENT_SAMPLES timings for the p50/p95/p99 in /stats. The same numbers can be scraped in the
+prometheus text format from start_metrics_server (optional, off unless a port is given).
+
+log_event writes one json line per event, but only for a LOG_SAMPLE_RATE fraction of them (warnings and errors are
+always written), so the log does not grow with the number or the size of the messages.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#upper bounds in seconds, from a cached render to a slow google call
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RECENT_SAMPLES = 1024
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+
+log = logging.getLogger("calendar_bot")
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)  # observations <= each bound, the +Inf bucket is count
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+
+    def percentiles(self) -> dict:
+        samples = sorted(self.recent)
+        if not samples:
+            return {}
+        return {name: samples[min(len(samples) - 1, int(q * len(samples)))] for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, stage: str):
+        #times the block, also when it raises
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "stages": {stage: {"count": histogram.count, **histogram.percentiles()} for stage, histogram in self.histograms.items()},
+            }
+
+    def report(self) -> str:
+        #plain text for the /stats command, times in ms
+        snapshot = self.snapshot()
+        lines = [f"uptime: {snapshot['uptime'] / 3600:.1f}h"]
+        lines += [f"{name}: {count}" for name, count in sorted(snapshot["counters"].items())]
+        for stage, stats in snapshot["stages"].items():
+            lines.append(f"{stage}: n={stats['count']} p50={stats['p50'] * 1000:.1f} p95={stats['p95'] * 1000:.1f} p99={stats['p99'] * 1000:.1f} ms")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        #prometheus text exposition format
+        lines = ["# TYPE calendar_bot_stage_seconds histogram"]
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f'calendar_bot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'calendar_bot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'calendar_bot_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'calendar_bot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, count in self.counters.items():
+                lines.append(f"# TYPE calendar_bot_{name}_total counter")
+                lines.append(f"calendar_bot_{name}_total {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+timed = metrics.timer
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    #one json line, sampled unless it is a warning or worse
+    if level < logging.WARNING and random.random() >= LOG_SAMPLE_RATE:
+        return
+    if log.isEnabledFor(level):
+        log.log(level, json.dumps({"event": event, **fields}, default=str))
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    #GET /metrics in the prometheus text format, on its own thread
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,143 @@
+"""
+Cache of rendered google calendar months, kept up to date with the calendar api's sync tokens.
+
+The first request for a month downloads all its events and keeps them with the nextSyncToken from the api.
+Later requests for the same month only send an incremental list call with that syncToken. If nothing changed, the
+rendered message is returned as it is, otherwise the changes are applied and the month is rendered again.
+If google says the token is no longer valid (HTTP 410) the month is downloaded again from scratch.
+
+Memory is bounded by a TTL (after which the month is downloaded again) and an LRU limit on the number of months.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class MonthEntry:
+    __slots__ = ("events", "sync_token", "rendered", "synced_at", "lock")
+
+    def __init__(self, events: dict, sync_token: str, rendered: str):
+        self.events = events  # event id -> event
+        self.sync_token = sync_token
+        self.rendered = rendered
+        self.synced_at = time.monotonic()
+        self.lock = threading.Lock()  # one incremental sync at a time per month
+
+
+def event_day(event: dict, key: str) -> str:
+    #yyyy-mm-dd of the start or end, timed events have dateTime and full day events have date
+    when = event.get(key, {})
+    return (when.get("dateTime") or when.get("date") or "")[:10]
+
+
+def in_window(event: dict, first_day: str, next_month_day: str) -> bool:
+    #true if the event overlaps the month
+    start = event_day(event, "start")
+    end = event_day(event, "end") or start
+    if "date" in event.get("end", {}):
+        # the end of a full day event is the day after it, exclusive
+        return bool(start) and start < next_month_day and end > first_day
+    return bool(start) and start < next_month_day and end >= first_day
+
+
+def is_gone(error: Exception) -> bool:
+    #HttpError 410 means the sync token expired and a full sync is needed
+    resp = getattr(error, "resp", None)
+    return getattr(resp, "status", None) == 410
+
+
+class MonthCache:
+    def __init__(self, full_sync, incremental_sync, max_months: int = 24, ttl: float = 6 * 3600):
+        """
+        full_sync(calendar_id, time_min, time_max) -> (events, next_sync_token)
+        incremental_sync(calendar_id, sync_token) -> (changed events, next_sync_token)
+        """
+        self.full_sync = full_sync
+        self.incremental_sync = incremental_sync
+        self.max_months = max_months
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "deltas": 0, "resyncs": 0, "evictions": 0}
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counts, "months": len(self.entries)}
+
+    def _get_entry(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry.synced_at > self.ttl:
+                    del self.entries[key]
+                    self.counts["evictions"] += 1
+                    return None
+                self.entries.move_to_end(key)
+            return entry
+
+    def _put_entry(self, key, entry: MonthEntry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_months:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def _download(self, key, calendar_id: str, time_min: str, time_max: str, render) -> MonthEntry:
+        events, sync_token = self.full_sync(calendar_id, time_min, time_max)
+        events = {event["id"]: event for event in events}
+        entry = MonthEntry(events, sync_token, render(sorted_events(events)))
+        self._put_entry(key, entry)
+        return entry
+
+    def get(self, calendar_id: str, time_min: str, time_max: str, render) -> str:
+        """
+        Rendered month for the calendar, time_min/time_max are the month bounds (rfc3339).
+        render(events) turns the month's events (in start order) into the message.
+        """
+        key = (calendar_id, time_min, time_max)
+        entry = self._get_entry(key)
+        if entry is None:
+            self._count("misses")
+            return self._download(key, calendar_id, time_min, time_max, render).rendered
+        if entry.sync_token is None:
+            # the api did not give a sync token, serve what we have until the ttl runs out
+            self._count("hits")
+            return entry.rendered
+
+        with entry.lock:
+            try:
+                changes, sync_token = self.incremental_sync(calendar_id, entry.sync_token)
+            except Exception as error:
+                if not is_gone(error):
+                    raise
+                self._count("resyncs")
+                return self._download(key, calendar_id, time_min, time_max, render).rendered
+
+            first_day, next_month_day = time_min[:10], time_max[:10]
+            changed = False
+            for event in changes:
+                # the changes are for the whole calendar, only the ones in this month matter
+                if event.get("status") != "cancelled" and in_window(event, first_day, next_month_day):
+                    entry.events[event["id"]] = event
+                    changed = True
+                elif entry.events.pop(event["id"], None) is not None:
+                    changed = True
+            entry.sync_token = sync_token or entry.sync_token
+
+            if changed:
+                self._count("deltas")
+                entry.rendered = render(sorted_events(entry.events))
+            else:
+                self._count("hits")
+            return entry.rendered
+
+
+def sorted_events(events: dict) -> list:
+    #start time order, full day events (date only) before the timed ones of the same day
+    return sorted(events.values(), key=lambda event: (event_day(event, "start"), event.get("start", {}).get("dateTime", "")))
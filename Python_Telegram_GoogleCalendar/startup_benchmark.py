@@ -0,0 +1,88 @@
+"""
+Cold start benchmark for the bot: how long `import main` takes and how much memory the process has after it.
+
+Each run is a fresh python process with -X importtime, so nothing is already imported or cached in memory (the files
+themselves will be in the os cache after the first run, that is why there are several runs and the best is kept).
+With --rev the same is done for the bot as it was at that git revision, eg. to see the change from dropping pandas/numpy:
+
+Usage: python startup_benchmark.py --rev HEAD~1 --runs 5
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+#prints the peak resident memory of the process after the import, in kB on linux
+PROBE = "import main, resource; print('maxrss', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure(folder: str) -> dict:
+    #one cold import of main in folder: total import time, peak memory and the slowest of main's own imports
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=folder, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    #importtime prints a module after the ones it imported, indented by how deep it is
+    top_level, children, pending = [], [], []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(3)) // 2
+        module = (int(match.group(2)), match.group(4))
+        if depth == 0:
+            top_level.append(module)
+            if module[1] == "main":
+                children = pending
+            pending = []
+        elif depth == 1:
+            pending.append(module)
+    return {
+        "import_ms": sum(cumulative for cumulative, _ in top_level) / 1000,
+        "maxrss_mb": int(result.stdout.split("maxrss")[-1]) / 1024,
+        "slowest": sorted(children, reverse=True)[:5],
+    }
+
+
+def best_of(folder: str, runs: int) -> dict:
+    results = [measure(folder) for _ in range(runs)]
+    return min(results, key=lambda result: result["import_ms"])
+
+
+def checkout(rev: str, target: str) -> str:
+    #this folder as it was at rev, exported into target
+    repo = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    prefix = os.path.relpath(HERE, repo)
+    archive = subprocess.run(["git", "archive", rev, prefix], cwd=repo, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return os.path.join(target, prefix)
+
+
+def report(name: str, result: dict):
+    print(f"{name}: import main {result['import_ms']:.0f} ms, peak memory {result['maxrss_mb']:.1f} MB")
+    for cumulative, module in result["slowest"]:
+        print(f"    {cumulative / 1000:8.1f} ms  {module}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rev", help="also measure the bot at this git revision")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    current = best_of(HERE, args.runs)
+    report("current", current)
+    if args.rev:
+        with tempfile.TemporaryDirectory() as target:
+            old = best_of(checkout(args.rev, target), args.runs)
+        report(args.rev, old)
+        print(f"import time {old['import_ms'] / current['import_ms']:.1f}x faster, "
+              f"{old['maxrss_mb'] - current['maxrss_mb']:.1f} MB less memory")
+
+
+if __name__ == "__main__":
+    main_cli()
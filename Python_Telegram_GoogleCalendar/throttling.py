@@ -0,0 +1,55 @@
+"""
+Keeps bursts of messages from turning into bursts of google calendar work.
+
+SingleFlight: when several chats (or several people in a group) ask for the same month at the same time, only the
+first request does the work (credentials, calendar list call, render), the others wait for it and get the same message.
+The key is the normalized request, eg. ("gc", 9, 2024), so "refresh gc SEP 2024" and "refresh gc sep 2024" are the same.
+
+ChatRateLimiter: a token bucket per chat, so one chat sending a lot of messages quickly is cut off (the extra messages
+are dropped) without affecting the other chats.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class SingleFlight:
+    def __init__(self):
+        self.in_flight = {}  # key -> future of the request that is doing the work
+
+    async def run(self, key, work):
+        """
+        Result of work() (a coroutine function), shared with every call with the same key made while it runs.
+        Returns (result, True if this call waited on another one).
+        """
+        future = self.in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = asyncio.ensure_future(work())
+        self.in_flight[key] = future
+        future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # shield, so one waiter giving up (eg. its update is cancelled) does not cancel the work for the others
+        return await asyncio.shield(future), False
+
+
+class ChatRateLimiter:
+    def __init__(self, per_minute: float = 20, burst: int = 5, max_chats: int = 10000):
+        self.rate = per_minute / 60  # tokens per second
+        self.burst = burst
+        self.max_chats = max_chats
+        self.buckets = OrderedDict()  # chat id -> [tokens, last refill], least recently seen first
+        self.lock = threading.Lock()
+
+    def allow(self, chat_id) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(chat_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            self.buckets[chat_id] = [tokens - 1 if allowed else tokens, now]
+            while len(self.buckets) > self.max_chats:
+                # a chat that has not been seen for a while has a full bucket again anyway
+                self.buckets.popitem(last=False)
+            return allowed